@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response
 from flask_cors import CORS
 from openai import OpenAI
 import os
@@ -6,9 +6,25 @@ import json
 import whisper_timestamped as whisper
 from utility.script.script_generator import generate_script
 from utility.audio.audio_generator import generate_audio
+from utility.audio.sentence_audio import generate_script_audio, TTS_MODES, TTS_MODE
 from utility.captions.timed_captions_generator import generate_timed_captions
-from utility.video.background_video_generator import generate_video_url
-from utility.render.render_engine import get_output_media
+from utility.video.background_video_generator import generate_video_url, VIDEO_SERVERS
+from utility.video.background_video_generator import VIDEO_SERVER as DEFAULT_VIDEO_SERVER
+from utility.render.render_engine import get_output_media, CAPTION_MODES, CAPTION_MODE
+from utility.render.render_engine import RENDER_ENGINES, RENDER_ENGINE
+from utility.render.render_engine import RENDER_PROFILES, RENDER_PROFILE
+from utility.render.render_engine import OUTPUT_MODES, OUTPUT_MODE
+from utility.render.hls_output import HLS_PLAYLIST
+from utility.theme.theme_analyzer import analyze_theme, THEME_MODES, THEME_MODE
+from utility.render import caption_renderer
+from utility.captions.subtitle_writer import to_srt, to_vtt, write_subtitles
+from utility.llm import gateway as llm_gateway
+from utility.tracer import RENDER_TRACE, Tracer, deactivate, span, traced
+from utility.incremental import plan_edit
+from utility import epub_processor
+from utility.video import keyword_extractor, pexels_cache, clip_cache
+from utility.video.video_search_query_generator import KEYWORD_MODE
+from utility.video.keyword_extractor import KEYWORD_MODES
 from utility.video.video_search_query_generator import getVideoSearchQueriesTimed, merge_empty_intervals
 from dotenv import load_dotenv
 import time
@@ -19,6 +35,10 @@ import contextlib
 import threading
 import logging
 import shutil
+import tempfile
+import zipfile
+from xml.etree.ElementTree import ParseError
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
@@ -44,11 +64,20 @@ CORS(app,
 # Store job statuses
 jobs = {}
 audio_jobs = {}  # New dictionary for audio-only jobs
+# Intermediate pipeline results per job (captions, ...), kept out of the
+# status payload
+job_artifacts = {}
+# Profiling traces of jobs started with trace enabled
+job_traces = {}
 
 # Lock for thread safety
 jobs_lock = threading.Lock()
 audio_jobs_lock = threading.Lock()
 
+# Theme selection runs here while the job generates its audio, so it never
+# holds up the render stage
+theme_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="theme")
+
 
 def capture_output(func):
     """Decorator to capture stdout and stderr"""
@@ -61,27 +90,78 @@ def capture_output(func):
     return wrapper
 
 
+def traced_theme_analysis(script, theme_mode=None):
+    with span("theme", mode=theme_mode):
+        return analyze_theme(script, theme_mode)
+
+
 @capture_output
-def process_video_generation(job_id, script):
-    """Process video generation in the background"""
+def process_video_generation(job_id, script, options=None):
+    """Process video generation in the background.
+
+    Stages whose results are already in job_artifacts (e.g. a promoted
+    draft) are skipped and their results reused.
+    """
+    options = options or {}
+    if options.get('trace'):
+        tracer = job_traces[job_id] = Tracer(job_id)
+        tracer.activate()
     try:
         with jobs_lock:
             jobs[job_id]['status'] = 'processing'
             jobs[job_id]['progress'] = 0
             jobs[job_id]['logs'] = []
+            artifacts = job_artifacts[job_id]
+            artifacts['script'] = script
 
         # Define constants
-        SAMPLE_FILE_NAME = f"audio_{job_id}.wav"
-        VIDEO_SERVER = "pexel"
+        SAMPLE_FILE_NAME = artifacts.get('audio_file', f"audio_{job_id}.wav")
+        VIDEO_SERVER = options.get('video_server', DEFAULT_VIDEO_SERVER)
         OUTPUT_FILE = f"output/video_{job_id}.mp4"
+        HLS_DIR = f"output/hls_{job_id}"
+
+        # An edit of a finished job reuses every stage result that the
+        # changed sentences do not touch
+        base_job_id = options.get('base_job_id')
+        if base_job_id and 'audio_file' not in artifacts:
+            with jobs_lock:
+                jobs[job_id]['progress'] = 10
+                jobs[job_id]['message'] = "Reusing the unchanged parts of the base job..."
+                jobs[job_id]['logs'].append(f"Diffing script against job {base_job_id}...")
+                base_artifacts = dict(job_artifacts.get(base_job_id, {}))
+            edit_stats = {}
+            with span("edit", base_job_id=base_job_id):
+                edited = plan_edit(base_artifacts, script, SAMPLE_FILE_NAME,
+                                   video_server=VIDEO_SERVER,
+                                   keyword_mode=options.get('keyword_mode'), stats=edit_stats)
+            with jobs_lock:
+                if edited is None:
+                    jobs[job_id]['logs'].append(
+                        "Base job has no sentence-level audio, generating from scratch")
+                else:
+                    artifacts.update(edited)
+                    jobs[job_id]['edit_stats'] = edit_stats
+                    jobs[job_id]['logs'].append("Unchanged sentences reused")
+
+        # Pick the theme from the script concurrently with TTS
+        theme_future = None
+        if 'theme' not in artifacts:
+            theme_future = theme_executor.submit(traced(traced_theme_analysis), script,
+                                                 options.get('theme_mode'))
 
         # Generate audio
         with jobs_lock:
             jobs[job_id]['progress'] = 20
             jobs[job_id]['message'] = "Generating audio..."
             jobs[job_id]['logs'].append("Starting audio generation...")
-        generate_audio(script, SAMPLE_FILE_NAME)
+        if 'audio_file' not in artifacts:
+            with span("audio"):
+                sentences = generate_script_audio(script, SAMPLE_FILE_NAME,
+                                                  mode=options.get('tts_mode'))
+            with jobs_lock:
+                artifacts['sentences'] = sentences
         with jobs_lock:
+            artifacts['audio_file'] = SAMPLE_FILE_NAME
             jobs[job_id]['logs'].append("Audio generation completed")
 
         # Generate captions
@@ -89,8 +169,12 @@ def process_video_generation(job_id, script):
             jobs[job_id]['progress'] = 40
             jobs[job_id]['message'] = "Generating captions..."
             jobs[job_id]['logs'].append("Starting caption generation...")
-        timed_captions = generate_timed_captions(SAMPLE_FILE_NAME)
+        timed_captions = artifacts.get('timed_captions')
+        if timed_captions is None:
+            with span("captions"):
+                timed_captions = generate_timed_captions(SAMPLE_FILE_NAME)
         with jobs_lock:
+            artifacts['timed_captions'] = timed_captions
             jobs[job_id]['logs'].append("Caption generation completed")
 
         # Generate search queries
@@ -98,8 +182,17 @@ def process_video_generation(job_id, script):
             jobs[job_id]['progress'] = 60
             jobs[job_id]['message'] = "Generating video search queries..."
             jobs[job_id]['logs'].append("Starting search query generation...")
-        search_terms = getVideoSearchQueriesTimed(script, timed_captions)
+        search_terms = artifacts.get('search_terms')
+        if search_terms is None:
+            keyword_stats = {}
+            with span("search_terms", keyword_mode=options.get('keyword_mode')):
+                search_terms = getVideoSearchQueriesTimed(
+                    script, timed_captions,
+                    keyword_mode=options.get('keyword_mode'), stats=keyword_stats)
+            with jobs_lock:
+                jobs[job_id]['keyword_stats'] = keyword_stats
         with jobs_lock:
+            artifacts['search_terms'] = search_terms
             jobs[job_id]['logs'].append("Search query generation completed")
 
         # Fetch background videos
@@ -109,11 +202,20 @@ def process_video_generation(job_id, script):
             jobs[job_id]['logs'].append(
                 "Starting background video fetching...")
         if search_terms is not None:
-            background_video_urls = generate_video_url(
-                search_terms, VIDEO_SERVER)
-            background_video_urls = merge_empty_intervals(
-                background_video_urls)
+            background_video_urls = artifacts.get('background_video_urls')
+            if background_video_urls is None:
+                with span("background_videos", video_server=VIDEO_SERVER):
+                    background_video_urls = generate_video_url(
+                        search_terms, VIDEO_SERVER)
+                    background_video_urls = merge_empty_intervals(
+                        background_video_urls)
+            theme = artifacts.get('theme')
+            if theme is None:
+                with span("theme.wait"):
+                    theme = theme_future.result()
             with jobs_lock:
+                artifacts['background_video_urls'] = background_video_urls
+                artifacts['theme'] = theme
                 jobs[job_id]['logs'].append(
                     "Background videos fetched successfully")
 
@@ -122,17 +224,32 @@ def process_video_generation(job_id, script):
                 jobs[job_id]['progress'] = 90
                 jobs[job_id]['message'] = "Rendering final video..."
                 jobs[job_id]['logs'].append("Starting video rendering...")
+                if options.get('output_mode') == 'hls':
+                    jobs[job_id]['playlist_url'] = f"/api/v1/stream/{job_id}/{HLS_PLAYLIST}"
             get_output_media(SAMPLE_FILE_NAME, timed_captions,
-                             background_video_urls, VIDEO_SERVER)
+                             background_video_urls, VIDEO_SERVER,
+                             caption_mode=options.get('caption_mode'),
+                             render_engine=options.get('render_engine'),
+                             render_profile=options.get('render_profile'),
+                             theme=theme,
+                             output_mode=options.get('output_mode'),
+                             hls_dir=HLS_DIR)
             with jobs_lock:
                 jobs[job_id]['logs'].append("Video rendering completed")
 
             # Copy the generated video to the job-specific filename
             if os.path.exists("output/rendered_video.mp4"):
                 shutil.copy2("output/rendered_video.mp4", OUTPUT_FILE)
+                # Sidecar captions are written from the job's own captions,
+                # since the renderer's output/rendered_video.* are shared
+                subtitle_files = None
+                if (options.get('caption_mode') or CAPTION_MODE) != 'burn':
+                    subtitle_files = write_subtitles(timed_captions, OUTPUT_FILE)
                 with jobs_lock:
                     jobs[job_id]['logs'].append(
                         "Video file copied to job-specific location")
+                    if subtitle_files:
+                        jobs[job_id]['subtitle_files'] = subtitle_files
 
                     # Update job status to completed
                     jobs[job_id]['status'] = 'completed'
@@ -157,6 +274,8 @@ def process_video_generation(job_id, script):
         jobs[job_id]['message'] = str(e)
         jobs[job_id]['logs'].append(f"Error: {str(e)}")
         logger.error(f"Error in video generation: {str(e)}", exc_info=True)
+    finally:
+        deactivate()
 
 
 @app.route('/api/v1/generate', methods=['POST'])
@@ -169,8 +288,90 @@ def generate_video():
                 'error': 'No text provided in request body'
             }), 400
 
+        base_job_id = data.get('base_job_id')
+        defaults = {}
+        if base_job_id is not None:
+            if base_job_id not in jobs:
+                return jsonify({
+                    'error': 'Base job not found'
+                }), 404
+            if jobs[base_job_id]['status'] != 'completed':
+                return jsonify({
+                    'error': 'Base job is not completed'
+                }), 400
+            # Edits default to the base job's options, including its engine: a
+            # parallel base re-encodes only the changed parts from its part
+            # cache, and captions are drawn the same way as in the base
+            defaults = dict(jobs[base_job_id].get('options', {}))
+
+        caption_mode = data.get('caption_mode', defaults.get('caption_mode', CAPTION_MODE))
+        if caption_mode not in CAPTION_MODES:
+            return jsonify({
+                'error': f"Invalid caption_mode. Expected one of: {', '.join(CAPTION_MODES)}"
+            }), 400
+
+        keyword_mode = data.get('keyword_mode', defaults.get('keyword_mode', KEYWORD_MODE))
+        if keyword_mode not in KEYWORD_MODES:
+            return jsonify({
+                'error': f"Invalid keyword_mode. Expected one of: {', '.join(KEYWORD_MODES)}"
+            }), 400
+
+        theme_mode = data.get('theme_mode', defaults.get('theme_mode', THEME_MODE))
+        if theme_mode not in THEME_MODES:
+            return jsonify({
+                'error': f"Invalid theme_mode. Expected one of: {', '.join(THEME_MODES)}"
+            }), 400
+
+        tts_mode = data.get('tts_mode', defaults.get('tts_mode', TTS_MODE))
+        if tts_mode not in TTS_MODES:
+            return jsonify({
+                'error': f"Invalid tts_mode. Expected one of: {', '.join(TTS_MODES)}"
+            }), 400
+
+        video_server = data.get('video_server', defaults.get('video_server', DEFAULT_VIDEO_SERVER))
+        if video_server not in VIDEO_SERVERS:
+            return jsonify({
+                'error': f"Invalid video_server. Expected one of: {', '.join(VIDEO_SERVERS)}"
+            }), 400
+
+        render_engine = data.get('render_engine', defaults.get('render_engine', RENDER_ENGINE))
+        if render_engine not in RENDER_ENGINES:
+            return jsonify({
+                'error': f"Invalid render_engine. Expected one of: {', '.join(RENDER_ENGINES)}"
+            }), 400
+
+        render_profile = data.get('render_profile', defaults.get('render_profile', RENDER_PROFILE))
+        if render_profile not in RENDER_PROFILES:
+            return jsonify({
+                'error': f"Invalid render_profile. Expected one of: {', '.join(RENDER_PROFILES)}"
+            }), 400
+
+        output_mode = data.get('output_mode', defaults.get('output_mode', OUTPUT_MODE))
+        if output_mode not in OUTPUT_MODES:
+            return jsonify({
+                'error': f"Invalid output_mode. Expected one of: {', '.join(OUTPUT_MODES)}"
+            }), 400
+
+        trace = data.get('trace', RENDER_TRACE)
+        if not isinstance(trace, bool):
+            return jsonify({
+                'error': 'Invalid trace. Expected true or false'
+            }), 400
+
         job_id = str(uuid.uuid4())
         script = data['text']
+        options = {
+            'caption_mode': caption_mode,
+            'keyword_mode': keyword_mode,
+            'theme_mode': theme_mode,
+            'tts_mode': tts_mode,
+            'video_server': video_server,
+            'render_engine': render_engine,
+            'render_profile': render_profile,
+            'output_mode': output_mode,
+            'trace': trace,
+            'base_job_id': base_job_id
+        }
 
         # Initialize job status
         with jobs_lock:
@@ -179,12 +380,14 @@ def generate_video():
                 'progress': 0,
                 'message': 'Job queued',
                 'created_at': time.time(),
+                'options': options,
                 'logs': []
             }
+            job_artifacts[job_id] = {}
 
         # Start processing in background thread
         thread = threading.Thread(
-            target=process_video_generation, args=(job_id, script))
+            target=process_video_generation, args=(job_id, script, options))
         thread.daemon = True  # Thread will exit when main program exits
         thread.start()
 
@@ -201,6 +404,65 @@ def generate_video():
         }), 500
 
 
+@app.route('/api/v1/jobs/<job_id>/promote', methods=['POST'])
+def promote_job(job_id):
+    """Re-render a completed (draft) job with another render profile.
+
+    The new job reuses the audio, captions, search terms, clips and theme of
+    the original, so only the render runs again.
+    """
+    try:
+        if job_id not in jobs:
+            return jsonify({
+                'error': 'Job not found'
+            }), 404
+
+        data = request.get_json(silent=True) or {}
+        render_profile = data.get('render_profile', 'standard')
+        if render_profile not in RENDER_PROFILES:
+            return jsonify({
+                'error': f"Invalid render_profile. Expected one of: {', '.join(RENDER_PROFILES)}"
+            }), 400
+
+        with jobs_lock:
+            artifacts = dict(job_artifacts.get(job_id, {}))
+            if jobs[job_id]['status'] != 'completed' or 'background_video_urls' not in artifacts:
+                return jsonify({
+                    'error': 'Only completed jobs can be promoted'
+                }), 400
+
+            promoted_id = str(uuid.uuid4())
+            options = dict(jobs[job_id].get('options', {}), render_profile=render_profile)
+            jobs[promoted_id] = {
+                'status': 'queued',
+                'progress': 0,
+                'message': 'Job queued',
+                'created_at': time.time(),
+                'options': options,
+                'promoted_from': job_id,
+                'logs': []
+            }
+            job_artifacts[promoted_id] = artifacts
+
+        thread = threading.Thread(
+            target=process_video_generation,
+            args=(promoted_id, artifacts['script'], options))
+        thread.daemon = True
+        thread.start()
+
+        return jsonify({
+            'job_id': promoted_id,
+            'status': 'queued',
+            'message': f'Promotion to {render_profile} started'
+        }), 202
+
+    except Exception as e:
+        logger.error(f"Error in promote endpoint: {str(e)}", exc_info=True)
+        return jsonify({
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/v1/status/<job_id>', methods=['GET'])
 def get_status(job_id):
     """Get status of a video generation job"""
@@ -280,6 +542,155 @@ def download_video(job_id):
         }), 500
 
 
+@app.route('/api/v1/stream/<job_id>/<path:filename>', methods=['GET'])
+def stream_video(job_id, filename):
+    """Serve the HLS playlist and segments of a job, also while it renders"""
+    if job_id not in jobs:
+        return jsonify({
+            'error': 'Job not found'
+        }), 404
+
+    if jobs[job_id].get('options', {}).get('output_mode') != 'hls':
+        return jsonify({
+            'error': 'Job was not rendered with output_mode hls'
+        }), 400
+
+    hls_dir = os.path.abspath(f"output/hls_{job_id}")
+    if not os.path.exists(os.path.join(hls_dir, HLS_PLAYLIST)):
+        return jsonify({
+            'error': 'Stream not ready'
+        }), 404
+
+    if filename.endswith('.m3u8'):
+        response = send_from_directory(hls_dir, filename,
+                                       mimetype='application/vnd.apple.mpegurl')
+        # The playlist grows while the job renders
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return send_from_directory(hls_dir, filename, mimetype='video/mp2t')
+
+
+@app.route('/api/v1/trace/<job_id>', methods=['GET'])
+def get_trace(job_id):
+    """Download the profiling trace of a job as Chrome trace JSON"""
+    if job_id not in jobs:
+        return jsonify({
+            'error': 'Job not found'
+        }), 404
+
+    tracer = job_traces.get(job_id)
+    if tracer is None:
+        return jsonify({
+            'error': 'Job was not traced'
+        }), 400
+
+    # Also available while the job runs, with the spans finished so far
+    return Response(
+        json.dumps(tracer.to_chrome_trace()),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename=trace_{job_id}.json'})
+
+
+@app.route('/api/v1/captions/<job_id>', methods=['GET'])
+def get_captions(job_id):
+    """Get the timed captions of a job as JSON, SRT or WebVTT"""
+    if job_id not in jobs:
+        return jsonify({
+            'error': 'Job not found'
+        }), 404
+
+    timed_captions = job_artifacts.get(job_id, {}).get('timed_captions')
+    if timed_captions is None:
+        return jsonify({
+            'error': 'Captions not ready'
+        }), 400
+
+    fmt = request.args.get('format', 'json')
+    if fmt == 'srt':
+        return Response(to_srt(timed_captions), mimetype='application/x-subrip')
+    if fmt == 'vtt':
+        return Response(to_vtt(timed_captions), mimetype='text/vtt')
+    if fmt != 'json':
+        return jsonify({
+            'error': 'Invalid format. Expected one of: json, srt, vtt'
+        }), 400
+
+    return jsonify({
+        'captions': [
+            {'start': start, 'end': end, 'text': text}
+            for (start, end), text in timed_captions
+        ]
+    })
+
+
+@app.route('/api/v1/books', methods=['POST'])
+def upload_book():
+    """Ingest an EPUB and return its chapter list (titles and word counts)"""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({
+            'error': 'No EPUB file provided (multipart field "file")'
+        }), 400
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.epub')
+    os.close(fd)
+    try:
+        upload.save(tmp_path)
+        # Parsed once per distinct file; re-uploads are served from the cache
+        book = epub_processor.ingest_book(tmp_path, filename=upload.filename)
+    except (zipfile.BadZipFile, KeyError, ParseError, ValueError) as e:
+        logger.error(f"Invalid EPUB {upload.filename}: {str(e)}")
+        return jsonify({
+            'error': 'Invalid EPUB file'
+        }), 400
+    finally:
+        os.remove(tmp_path)
+
+    return jsonify(book), 201
+
+
+@app.route('/api/v1/books', methods=['GET'])
+def list_books():
+    """List ingested books with their chapters, without chapter text"""
+    return jsonify({
+        'books': epub_processor.list_books()
+    })
+
+
+@app.route('/api/v1/books/<book_id>', methods=['GET'])
+def get_book(book_id):
+    """Get a book's chapter list"""
+    book = epub_processor.get_book(book_id)
+    if book is None:
+        return jsonify({
+            'error': 'Book not found'
+        }), 404
+    return jsonify(book)
+
+
+@app.route('/api/v1/books/<book_id>/chapters/<chapter_id>', methods=['GET'])
+def get_book_chapter(book_id, chapter_id):
+    """Get the text of one chapter"""
+    chapter = epub_processor.get_chapter(book_id, chapter_id)
+    if chapter is None:
+        return jsonify({
+            'error': 'Chapter not found'
+        }), 404
+    return jsonify(chapter)
+
+
+@app.route('/api/v1/metrics', methods=['GET'])
+def get_metrics():
+    """Get pipeline metrics"""
+    return jsonify({
+        'llm': llm_gateway.get_metrics(),
+        'keywords': keyword_extractor.get_stats(),
+        'pexels_cache': pexels_cache.get_stats(),
+        'clip_cache': clip_cache.get_stats(),
+        'captions': caption_renderer.get_stats()
+    })
+
+
 @app.route('/api/v1/jobs', methods=['GET'])
 def list_jobs():
     """List all jobs"""
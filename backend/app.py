@@ -6,12 +6,15 @@ from utility.script.script_generator import generate_script
 from utility.audio.audio_generator import generate_audio
 from utility.captions.timed_captions_generator import generate_timed_captions
 from utility.video.background_video_generator import generate_video_url
+from utility.video.background_video_generator import VIDEO_SERVER as DEFAULT_VIDEO_SERVER
 from utility.render.render_engine import get_output_media
+from utility.theme.theme_analyzer import analyze_theme
 from utility.video.video_search_query_generator import getVideoSearchQueriesTimed, merge_empty_intervals
 import argparse
 from dotenv import load_dotenv
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, render_template, request, send_file, jsonify, Response
 from werkzeug.utils import secure_filename
 
@@ -63,12 +66,13 @@ def generate():
 
         # Define constants
         SAMPLE_FILE_NAME = "audio_tts.wav"
-        VIDEO_SERVER = "pexel"
+        VIDEO_SERVER = DEFAULT_VIDEO_SERVER
         OUTPUT_FILE = "output/rendered_video.mp4"
 
         send_progress("Starting video generation...")
         send_progress(f"Processing script: {script[:50]}...")
 
+        theme_future = start_theme_analysis(script)
         send_progress("Generating audio using Whisper...")
         generate_audio(script, SAMPLE_FILE_NAME)
         send_progress("Audio generated successfully")
@@ -94,7 +98,8 @@ def generate():
 
         send_progress("Rendering final video...")
         get_output_media(SAMPLE_FILE_NAME, timed_captions,
-                         background_video_urls, VIDEO_SERVER)
+                         background_video_urls, VIDEO_SERVER,
+                         theme=theme_future.result())
         send_progress("Video rendering completed!")
 
         return send_file(OUTPUT_FILE, mimetype='video/mp4')
@@ -105,6 +110,14 @@ def generate():
         return jsonify({'error': error_message}), 500
 
 
+def start_theme_analysis(script):
+    """Pick the theme from the script in the background while TTS runs"""
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(analyze_theme, script)
+    pool.shutdown(wait=False)
+    return future
+
+
 def print_status(message, is_error=False):
     timestamp = time.strftime("%H:%M:%S")
     prefix = "❌ ERROR" if is_error else "✅"
@@ -119,7 +132,7 @@ def main():
 
     # Define constants
     SAMPLE_FILE_NAME = "audio_tts.wav"
-    VIDEO_SERVER = "pexel"
+    VIDEO_SERVER = DEFAULT_VIDEO_SERVER
 
     # Get the script directly from command line argument
     script = sys.argv[1]
@@ -129,6 +142,7 @@ def main():
     try:
         print_status(f"Starting video generation for script: {script}")
 
+        theme_future = start_theme_analysis(script)
         print_status("Generating audio using Whisper...")
         generate_audio(script, SAMPLE_FILE_NAME)
         print_status("Audio generated successfully")
@@ -159,7 +173,8 @@ def main():
         print_status("Rendering final video...")
         if background_video_urls is not None:
             video = get_output_media(
-                SAMPLE_FILE_NAME, timed_captions, background_video_urls, VIDEO_SERVER)
+                SAMPLE_FILE_NAME, timed_captions, background_video_urls, VIDEO_SERVER,
+                theme=theme_future.result())
             print_status("Video rendered successfully")
             print("Output video:", video)
         else:
@@ -0,0 +1,126 @@
+"""
+Compare Whisper inference backends on latency and accuracy.
+
+The stock "torch" backend is the reference: every other backend is scored by
+word error rate against its transcript and by the mean absolute deviation of
+word timestamps for the words both backends agree on.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_captions [audio.wav ...] [--backends torch torch-int8 faster-whisper]
+"""
+import argparse
+import difflib
+import glob
+import json
+import re
+import time
+
+from utility.captions.timed_captions_generator import (WHISPER_BACKENDS, get_model,
+                                                       transcribe)
+
+
+def normalize_words(result):
+    words = []
+    for segment in result['segments']:
+        for word in segment['words']:
+            text = re.sub(r"[^\w']", "", word['text'].lower())
+            if text:
+                words.append((text, word['start'], word['end']))
+    return words
+
+
+def word_error_rate(reference, hypothesis):
+    """Levenshtein distance over words, divided by the reference length."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1] / max(1, len(reference))
+
+
+def timestamp_deviation(reference, hypothesis):
+    """Mean absolute start/end difference (seconds) over matched words."""
+    matcher = difflib.SequenceMatcher(a=[w[0] for w in reference],
+                                      b=[w[0] for w in hypothesis],
+                                      autojunk=False)
+    deltas = []
+    for block in matcher.get_matching_blocks():
+        for k in range(block.size):
+            ref = reference[block.a + k]
+            hyp = hypothesis[block.b + k]
+            deltas.append((abs(ref[1] - hyp[1]) + abs(ref[2] - hyp[2])) / 2)
+    return sum(deltas) / len(deltas) if deltas else None
+
+
+def audio_duration(path):
+    import wave
+    with wave.open(path) as f:
+        return f.getnframes() / f.getframerate()
+
+
+def run(files, backends, model_size):
+    rows = []
+    for backend in backends:
+        start = time.perf_counter()
+        try:
+            model = get_model(model_size, backend)
+        except ImportError as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+        load_time = time.perf_counter() - start
+
+        for path in files:
+            start = time.perf_counter()
+            result = transcribe(model, path, backend)
+            elapsed = time.perf_counter() - start
+            rows.append({'backend': backend,
+                         'file': path,
+                         'load_seconds': load_time,
+                         'seconds': elapsed,
+                         'realtime_factor': elapsed / audio_duration(path),
+                         'words': normalize_words(result)})
+
+    references = {row['file']: row['words'] for row in rows if row['backend'] == "torch"}
+    for row in rows:
+        reference = references.get(row['file'])
+        hypothesis = [w[0] for w in row['words']]
+        row['wer'] = word_error_rate([w[0] for w in reference], hypothesis) if reference else None
+        row['timestamp_mad'] = timestamp_deviation(reference, row['words']) if reference else None
+        row['words'] = len(row['words'])
+    return rows
+
+
+def summarize(rows):
+    print(f"{'backend':<16}{'load s':>8}{'mean s':>9}{'RTF':>7}{'WER':>8}{'ts MAD':>9}")
+    for backend in dict.fromkeys(row['backend'] for row in rows):
+        subset = [row for row in rows if row['backend'] == backend]
+        mean = lambda key: (sum(r[key] for r in subset if r[key] is not None) /
+                            max(1, sum(r[key] is not None for r in subset)))
+        print(f"{backend:<16}{subset[0]['load_seconds']:>8.2f}{mean('seconds'):>9.2f}"
+              f"{mean('realtime_factor'):>7.2f}{mean('wer'):>8.3f}{mean('timestamp_mad'):>9.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="WAV files (default: audio_*.wav)")
+    parser.add_argument("--backends", nargs="+", default=list(WHISPER_BACKENDS),
+                        choices=WHISPER_BACKENDS)
+    parser.add_argument("--model-size", default="base")
+    parser.add_argument("--json", help="Write per-file results to this path")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob("audio_*.wav"))
+    rows = run(files, args.backends, args.model_size)
+    summarize(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare the moviepy and ffmpeg render engines on the same inputs.
+
+Synthetic inputs are generated with ffmpeg: background clips of varying
+length and size, a voice track, a music track and one caption per second.
+Proxies (CLIP_PROXIES) are built before timing, so both engines start from
+the same cached clips.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_render [--seconds 30] [--clips 6] [--engines moviepy ffmpeg]
+                                      [--profile draft|standard|archival]
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from moviepy.config import get_setting
+from utility.render.render_engine import RENDER_ENGINES, RENDER_PROFILES, render_video
+from utility.video.clip_ingest import CLIP_PROXIES, make_proxy
+
+WORDS = "the quick brown fox jumps over the lazy dog near a quiet river bank".split()
+
+
+def ffmpeg(*args):
+    subprocess.run([get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *args], check=True)
+
+
+def make_inputs(work_dir, seconds, clips):
+    segment = seconds / clips
+    background_video_urls = []
+    for i in range(clips):
+        path = os.path.join(work_dir, f"clip_{i}.mp4")
+        # Alternate landscape and portrait sources, some shorter than their segment
+        size = "1280x720" if i % 2 else "720x1280"
+        length = segment * (0.6 if i % 3 == 2 else 1.5)
+        ffmpeg("-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25:duration={length:.3f}",
+               "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path)
+        background_video_urls.append([i * segment, (i + 1) * segment, path,
+                                      {'url': path, 'duration': length}])
+
+    voice = os.path.join(work_dir, "voice.wav")
+    ffmpeg("-f", "lavfi", "-i", f"sine=frequency=220:duration={seconds}", voice)
+    music = os.path.join(work_dir, "music.mp3")
+    ffmpeg("-f", "lavfi", "-i", "anoisesrc=color=pink:duration=7", "-c:a", "libmp3lame", music)
+
+    timed_captions = [((float(t), float(t + 1)), " ".join(WORDS[t % 8:t % 8 + 4]))
+                      for t in range(int(seconds))]
+    return background_video_urls, voice, music, timed_captions
+
+
+def run(seconds, clips, engines, caption_mode, profile_name):
+    profile = RENDER_PROFILES[profile_name]
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="bench_render_") as work_dir:
+        background_video_urls, voice, music, timed_captions = make_inputs(work_dir, seconds, clips)
+        if CLIP_PROXIES:
+            for url_data in background_video_urls:
+                make_proxy(url_data[2], profile['width'], profile['height'], profile['fps'],
+                           work_dir)
+
+        for engine in engines:
+            output_path = os.path.join(work_dir, f"out_{engine}.mp4")
+            start = time.perf_counter()
+            render_video(voice, timed_captions, background_video_urls, music, output_path,
+                         caption_mode, engine, fallback=False, profile=profile)
+            elapsed = time.perf_counter() - start
+            rows.append({'engine': engine,
+                         'profile': profile_name,
+                         'caption_mode': caption_mode,
+                         'seconds': elapsed,
+                         'realtime_factor': elapsed / seconds,
+                         'output_bytes': os.path.getsize(output_path)})
+    return rows
+
+
+def summarize(rows):
+    print(f"{'engine':<10}{'profile':>10}{'captions':>10}{'render s':>10}{'RTF':>7}{'MB':>8}")
+    for row in rows:
+        print(f"{row['engine']:<10}{row['profile']:>10}{row['caption_mode']:>10}{row['seconds']:>10.2f}"
+              f"{row['realtime_factor']:>7.2f}{row['output_bytes'] / 1e6:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--clips", type=int, default=6)
+    parser.add_argument("--engines", nargs="+", default=list(RENDER_ENGINES),
+                        choices=RENDER_ENGINES)
+    parser.add_argument("--caption-mode", default="burn", choices=("burn", "sidecar"))
+    parser.add_argument("--profile", default="standard", choices=list(RENDER_PROFILES))
+    parser.add_argument("--json", help="Write results to this path")
+    args = parser.parse_args()
+
+    rows = run(args.seconds, args.clips, args.engines, args.caption_mode, args.profile)
+    summarize(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import wave
+
+import pytest
+
+from utility import incremental
+from utility.audio.sentence_audio import SENTENCE_QUANTUM, assemble_audio
+
+RATE = 24000
+TOLERANCE = 1e-6
+BASE_SCRIPT = "The sun rises. Birds sing loudly. A river runs past the old mill. Night falls."
+
+
+def write_wav(path, seconds, value=1000):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(value.to_bytes(2, "little", signed=True) * round(seconds * RATE))
+    return path
+
+
+def wav_duration(path):
+    with wave.open(path, "rb") as f:
+        return f.getnframes() / f.getframerate()
+
+
+def whole_quanta(seconds):
+    return abs(seconds / SENTENCE_QUANTUM - round(seconds / SENTENCE_QUANTUM)) < TOLERANCE
+
+
+def assert_contiguous(segments, total_duration):
+    starts_ends = [(segment[0], segment[1]) for segment in segments]
+    assert starts_ends[0][0] == pytest.approx(0.0)
+    for (_, end), (start, _) in zip(starts_ends, starts_ends[1:]):
+        assert start == pytest.approx(end)
+    assert starts_ends[-1][1] == pytest.approx(total_duration)
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    """
+    TTS, Whisper, search terms and clip lookup replaced by deterministic
+    fakes; calls are counted per service
+    """
+    calls = {'tts': [], 'captions': 0, 'search': 0, 'clips': 0}
+
+    def synthesize_sentences(texts, stats=None):
+        paths = []
+        for text in texts:
+            calls['tts'].append(text)
+            path = str(tmp_path / f"tts_{len(calls['tts'])}.wav")
+            # Speech length depends on the text, never a whole quantum
+            paths.append(write_wav(path, 0.31 + 0.037 * len(text)))
+            incremental.record_stats(stats, synthesized=1)
+        return paths
+
+    def generate_timed_captions(audio_file):
+        calls['captions'] += 1
+        return [((0.0, wav_duration(audio_file)), "new words")]
+
+    def get_search_terms(script, timed_captions, keyword_mode=None, stats=None):
+        calls['search'] += 1
+        return [[start, end, ["new term"]] for (start, end), _ in timed_captions]
+
+    def generate_video_url(search_terms, server):
+        calls['clips'] += 1
+        return [[start, end, "new.mp4"] for start, end, _ in search_terms]
+
+    monkeypatch.setattr(incremental, "synthesize_sentences", synthesize_sentences)
+    monkeypatch.setattr(incremental, "generate_timed_captions", generate_timed_captions)
+    monkeypatch.setattr(incremental, "getVideoSearchQueriesTimed", get_search_terms)
+    monkeypatch.setattr(incremental, "generate_video_url", generate_video_url)
+    return calls
+
+
+@pytest.fixture
+def base_job(tmp_path, services):
+    """Artifacts of a finished sentence-level job for BASE_SCRIPT"""
+    texts = incremental.split_sentences(BASE_SCRIPT)
+    paths = incremental.synthesize_sentences(texts)
+    audio_file = str(tmp_path / "base.wav")
+    spans = assemble_audio([(path, None, None) for path in paths], audio_file)
+    sentences = [(text, start, end) for text, (start, end) in zip(texts, spans)]
+    services['tts'].clear()
+    return {
+        'audio_file': audio_file,
+        'sentences': sentences,
+        # Captions cover the speech, not the silence padding after it
+        'timed_captions': [((start, start + 0.2), text) for text, start, _ in sentences],
+        'search_terms': [[start, end, [text]] for text, start, end in sentences],
+        'background_video_urls': [[start, end, f"base_{i}.mp4"]
+                                  for i, (_, start, end) in enumerate(sentences)]
+    }
+
+
+def test_assemble_audio_pads_each_piece_to_whole_quanta(tmp_path):
+    pieces = [(write_wav(str(tmp_path / f"{i}.wav"), seconds), None, None)
+              for i, seconds in enumerate((0.5, 0.23, 1.01))]
+    output = str(tmp_path / "out.wav")
+    spans = assemble_audio(pieces, output)
+
+    assert spans[0][0] == 0.0
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        assert start == end
+    for (start, end), seconds in zip(spans, (0.5, 0.23, 1.01)):
+        assert whole_quanta(end - start)
+        assert seconds <= end - start < seconds + SENTENCE_QUANTUM
+    assert wav_duration(output) == pytest.approx(spans[-1][1])
+
+
+def test_assemble_audio_cuts_ranges(tmp_path):
+    source = write_wav(str(tmp_path / "source.wav"), 2.0)
+    spans = assemble_audio([(source, 0.5, 1.1), (source, 1.5, None)], str(tmp_path / "out.wav"))
+    assert spans[0] == pytest.approx((0.0, 4 * SENTENCE_QUANTUM))
+    assert spans[1][1] - spans[1][0] == pytest.approx(3 * SENTENCE_QUANTUM)
+
+
+EDITS = {
+    # edit: (new script, sentences reused, sentences synthesized)
+    'insert': ("The sun rises. Birds sing loudly. Wind moves the tall grass. "
+               "A river runs past the old mill. Night falls.", 4, 1),
+    'delete': ("The sun rises. Birds sing loudly. Night falls.", 3, 0),
+    'replace': ("The sun rises. Frogs croak quietly. A river runs past the old mill. "
+                "Night falls.", 3, 1),
+}
+
+
+@pytest.mark.parametrize("edit", sorted(EDITS))
+def test_plan_edit_covers_the_edited_timeline(tmp_path, services, base_job, edit):
+    script, reused, synthesized = EDITS[edit]
+    stats = {}
+    edited = incremental.plan_edit(base_job, script, str(tmp_path / "edit.wav"), stats=stats)
+    assert edited is not None
+
+    sentences = edited['sentences']
+    total_duration = sentences[-1][2]
+    assert [text for text, _, _ in sentences] == incremental.split_sentences(script)
+    assert_contiguous([(start, end) for _, start, end in sentences], total_duration)
+    assert all(whole_quanta(end - start) for _, start, end in sentences)
+    assert wav_duration(edited['audio_file']) == pytest.approx(total_duration)
+
+    # Unchanged sentences move by whole frames at 24 and 30 fps
+    base_starts = {text: start for text, start, _ in base_job['sentences']}
+    for text, start, _ in sentences:
+        if text in base_starts:
+            delta = start - base_starts[text]
+            assert whole_quanta(delta)
+            for fps in (24, 30):
+                assert delta * fps == pytest.approx(round(delta * fps))
+
+    # Search terms and clips cover the timeline without holes or overlaps
+    assert_contiguous(edited['search_terms'], total_duration)
+    assert_contiguous(edited['background_video_urls'], total_duration)
+
+    # Every sentence is captioned, and captions stay in order
+    captions = edited['timed_captions']
+    for ((_, end), _), ((start, _), _) in zip(captions, captions[1:]):
+        assert start >= end - TOLERANCE
+    for _, start, end in sentences:
+        assert any(caption_start < end and caption_end > start
+                   for (caption_start, caption_end), _ in captions)
+
+    assert len(services['tts']) == synthesized
+    assert stats['sentences_reused'] == reused
+    assert stats['sentences_synthesized'] == synthesized
+    assert stats['captions_reused'] == reused
+    assert stats['captions_transcribed'] == synthesized
+    assert stats['search_segments_reused'] == reused
+    assert stats['search_segments_new'] == synthesized
+    assert stats['clips_reused'] == reused
+    assert stats['clips_new'] == synthesized
+    # Only the changed stretch goes to Whisper, search and clip lookup
+    assert services['captions'] == synthesized
+    assert services['search'] == synthesized
+    assert services['clips'] == (1 if synthesized else 0)
+
+
+@pytest.fixture
+def crossing_base_job(base_job):
+    """
+    The same job with captions, search terms and clips on their own grid,
+    crossing sentence boundaries the way Whisper and search output does
+    """
+    total_duration = base_job['sentences'][-1][2]
+
+    def grid(step):
+        starts = [i * step for i in range(int(total_duration / step) + 1)
+                  if i * step < total_duration]
+        return [(start, min(start + step, total_duration)) for start in starts]
+
+    return dict(base_job,
+                timed_captions=[((start, start + 0.5), f"words {i}")
+                                for i, (start, _) in enumerate(grid(0.6))],
+                search_terms=[[start, end, [f"term {i}"]]
+                              for i, (start, end) in enumerate(grid(1.3))],
+                background_video_urls=[[start, end, f"base_{i}.mp4"]
+                                       for i, (start, end) in enumerate(grid(1.3))])
+
+
+@pytest.mark.parametrize("edit", sorted(EDITS))
+def test_plan_edit_fills_holes_left_by_crossing_segments(tmp_path, crossing_base_job, edit):
+    script, _, _ = EDITS[edit]
+    edited = incremental.plan_edit(crossing_base_job, script, str(tmp_path / "edit.wav"))
+    assert edited is not None
+    sentences = edited['sentences']
+    total_duration = sentences[-1][2]
+
+    assert_contiguous(edited['search_terms'], total_duration)
+    assert_contiguous(edited['background_video_urls'], total_duration)
+
+    captions = edited['timed_captions']
+    for ((_, end), _), ((start, _), _) in zip(captions, captions[1:]):
+        assert start >= end - TOLERANCE
+    for _, start, end in sentences:
+        assert any(caption_start < end and caption_end > start
+                   for (caption_start, caption_end), _ in captions)
+    # Captions dropped around the edit are transcribed again: no stretch
+    # without captions is longer than the base grid's spacing
+    edges = [0.0] + [edge for (start, end), _ in captions for edge in (start, end)]
+    edges.append(total_duration)
+    assert max(edges[i + 1] - edges[i] for i in range(0, len(edges), 2)) <= 0.1 + TOLERANCE
+
+
+def test_plan_edit_needs_sentence_level_base(tmp_path, base_job):
+    base_job['sentences'] = None
+    assert incremental.plan_edit(base_job, BASE_SCRIPT, str(tmp_path / "edit.wav")) is None
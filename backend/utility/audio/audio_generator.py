@@ -22,18 +22,16 @@
 
 
 import os
-from openai import OpenAI
 import base64
+from utility.llm.gateway import chat_audio
 
 
 def generate_audio(text: str, output_filename: str) -> str:
     """
     Generate audio from text using OpenAI's new GPT-4 audio model
     """
-    client = OpenAI()
-
     # Generate speech using OpenAI's new GPT-4 audio model
-    response = client.chat.completions.create(
+    audio_data = chat_audio(
         model="gpt-4o-audio-preview",
         modalities=["text", "audio"],
         audio={"voice": "alloy", "format": "wav"},
@@ -46,9 +44,6 @@ def generate_audio(text: str, output_filename: str) -> str:
         store=True
     )
 
-    # Extract audio data from response
-    audio_data = response.choices[0].message.audio.data
-
     # Decode base64 audio data and write to file
     with open(output_filename, 'wb') as f:
         f.write(base64.b64decode(audio_data))
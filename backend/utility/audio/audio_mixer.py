@@ -0,0 +1,146 @@
+import hashlib
+import os
+import subprocess
+import threading
+from functools import lru_cache
+import numpy as np
+from moviepy.config import get_setting
+
+# Theme music beds are decoded once into PCM .npy files and memory-mapped;
+# the voice/music mix is done with NumPy and encoded straight to AAC, so the
+# render never touches audio in its frame loop. The voice is decoded, mixed
+# and encoded in blocks, so memory does not grow with the video length.
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+# Samples mixed per block (about 1.5 s at 44.1 kHz)
+MIX_BLOCK_SAMPLES = 1 << 16
+MUSIC_CACHE_DIR = os.getenv("MUSIC_CACHE_DIR", ".cache/music")
+
+
+def decode_pcm(path, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    Decode any audio file to float32 PCM of shape (samples, channels)
+    """
+    result = subprocess.run([
+        get_setting("FFMPEG_BINARY"), "-loglevel", "error",
+        "-i", path,
+        "-f", "f32le", "-acodec", "pcm_f32le",
+        "-ac", str(AUDIO_CHANNELS), "-ar", str(sample_rate),
+        "-"
+    ], check=True, stdout=subprocess.PIPE)
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, AUDIO_CHANNELS)
+
+
+@lru_cache(maxsize=None)
+def _load_music_bed(path, size, mtime_ns, sample_rate):
+    fingerprint = f"{os.path.abspath(path)}|{size}|{mtime_ns}|{sample_rate}"
+    cache_path = os.path.join(MUSIC_CACHE_DIR,
+                              hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32] + ".npy")
+    if not os.path.exists(cache_path):
+        os.makedirs(MUSIC_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+        try:
+            np.save(tmp_path, decode_pcm(path, sample_rate))
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return np.load(cache_path, mmap_mode="r")
+
+
+def load_music_bed(path, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    Memory-mapped PCM of a music file, decoded on first use and cached on
+    disk (keyed by path, size and modification time)
+    """
+    stat = os.stat(path)
+    return _load_music_bed(path, stat.st_size, stat.st_mtime_ns, sample_rate)
+
+
+def read_pcm_blocks(path, sample_rate=AUDIO_SAMPLE_RATE, block_samples=None):
+    """
+    Decode an audio file to float32 PCM blocks of shape (block_samples,
+    channels), the last one shorter, without holding the whole file
+    """
+    block_samples = block_samples or MIX_BLOCK_SAMPLES
+    frame_bytes = 4 * AUDIO_CHANNELS
+    command = [
+        get_setting("FFMPEG_BINARY"), "-loglevel", "error",
+        "-i", path,
+        "-f", "f32le", "-acodec", "pcm_f32le",
+        "-ac", str(AUDIO_CHANNELS), "-ar", str(sample_rate),
+        "-"
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(block_samples * frame_bytes)
+            if not data:
+                break
+            data = data[:len(data) - len(data) % frame_bytes]
+            yield np.frombuffer(data, dtype=np.float32).reshape(-1, AUDIO_CHANNELS)
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+    finally:
+        # Also reached when the consumer stops early (voice longer than the video)
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def mix_blocks(voice_blocks, music, samples, voice_volume=1.0, music_volume=0.05):
+    """
+    Voice plus the music bed looped to samples length, each scaled by its
+    volume and summed like CompositeAudioClip, in blocks of MIX_BLOCK_SAMPLES
+    """
+    voice_blocks = iter(voice_blocks)
+    pending = np.zeros((0, AUDIO_CHANNELS), dtype=np.float32)
+    for start in range(0, samples, MIX_BLOCK_SAMPLES):
+        size = min(MIX_BLOCK_SAMPLES, samples - start)
+        mix = np.zeros((size, AUDIO_CHANNELS), dtype=np.float32)
+        filled = 0
+        while filled < size:
+            if not len(pending):
+                pending = next(voice_blocks, None)
+                if pending is None:
+                    # Voice ended: the rest is music only
+                    pending = np.zeros((0, AUDIO_CHANNELS), dtype=np.float32)
+                    break
+            count = min(size - filled, len(pending))
+            np.multiply(pending[:count], voice_volume, out=mix[filled:filled + count])
+            pending = pending[count:]
+            filled += count
+        if len(music):
+            # Only this block's stretch of the memory-mapped bed is read
+            mix += music[np.arange(start, start + size) % len(music)] * np.float32(music_volume)
+        np.clip(mix, -1.0, 1.0, out=mix)
+        yield mix
+
+
+def mix_audio(voice_path, music_path, duration, output_path, voice_volume=1.0,
+              music_volume=0.05, audio_bitrate=None, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    Mix the voice over the looped music bed for duration seconds and encode
+    the result to an AAC file at output_path, one block at a time
+    """
+    samples = int(round(duration * sample_rate))
+    music = load_music_bed(music_path, sample_rate)
+    command = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-f", "f32le", "-ac", str(AUDIO_CHANNELS), "-ar", str(sample_rate), "-i", "-",
+        "-c:a", "aac", *(["-b:a", audio_bitrate] if audio_bitrate else []),
+        "-f", "ipod", output_path
+    ]
+    encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+    voice_blocks = read_pcm_blocks(voice_path, sample_rate)
+    try:
+        for block in mix_blocks(voice_blocks, music, samples, voice_volume, music_volume):
+            encoder.stdin.write(block.tobytes())
+    finally:
+        voice_blocks.close()
+        encoder.stdin.close()
+        encoder.wait()
+    if encoder.returncode != 0:
+        raise subprocess.CalledProcessError(encoder.returncode, command)
+    return output_path
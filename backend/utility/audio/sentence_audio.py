@@ -0,0 +1,121 @@
+import hashlib
+import os
+import re
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from utility.audio.audio_generator import generate_audio
+
+# Sentence-level TTS. The script is split into sentences that are
+# synthesized concurrently, cached by their text and joined into the job's
+# audio. The span of every sentence in the joined file is kept, so an edited
+# script can reuse the audio of each unchanged sentence.
+#   "script"   - a single TTS call for the whole script (default); edits of
+#                such a job are regenerated from scratch
+#   "sentence" - one TTS call per sentence; prosody may differ across
+#                sentence boundaries, but edits reuse unchanged audio
+TTS_MODES = ("script", "sentence")
+TTS_MODE = os.getenv("TTS_MODE", "script")
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".cache/tts")
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 4))
+# Every sentence is padded with silence to a multiple of this many seconds,
+# so an edit shifts the rest of the timeline by whole frames at 24 and 30 fps
+SENTENCE_QUANTUM = 1 / 6
+
+
+def split_sentences(text):
+    sentences = re.split(r"(?<=[.!?])\s+|\n+", text.strip())
+    return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+
+def synthesize_sentence(text, stats=None):
+    """
+    Path of the cached TTS audio of one sentence, synthesized on first use
+    """
+    key = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    path = os.path.join(TTS_CACHE_DIR, key + ".wav")
+    if os.path.exists(path):
+        record_stats(stats, cached=1)
+        return path
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        generate_audio(text, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    record_stats(stats, synthesized=1)
+    return path
+
+
+def synthesize_sentences(texts, stats=None):
+    with ThreadPoolExecutor(max_workers=TTS_CONCURRENCY) as pool:
+        return list(pool.map(lambda text: synthesize_sentence(text, stats), texts))
+
+
+def record_stats(stats, **counts):
+    if stats is None:
+        return
+    for key, value in counts.items():
+        stats[key] = stats.get(key, 0) + value
+
+
+def assemble_audio(pieces, output_path):
+    """
+    Join WAV pieces into output_path. A piece is (path, start, end) in
+    seconds, or (path, None, None) for the whole file; each is padded to
+    SENTENCE_QUANTUM. Returns the (start, end) of every piece in the output.
+    """
+    spans = []
+    params = None
+    position = 0
+    with wave.open(output_path, "wb") as output:
+        for path, start, end in pieces:
+            with wave.open(path, "rb") as source:
+                piece_params = (source.getnchannels(), source.getsampwidth(),
+                                source.getframerate())
+                if params is None:
+                    params = piece_params
+                    output.setnchannels(params[0])
+                    output.setsampwidth(params[1])
+                    output.setframerate(params[2])
+                elif piece_params != params:
+                    raise ValueError(f"{path} does not match the audio format {params}")
+                rate = params[2]
+                first = round(start * rate) if start is not None else 0
+                last = round(end * rate) if end is not None else source.getnframes()
+                source.setpos(min(first, source.getnframes()))
+                frames = source.readframes(max(0, last - first))
+
+            count = len(frames) // (params[0] * params[1])
+            padding = -count % max(1, round(rate * SENTENCE_QUANTUM))
+            output.writeframes(frames + b"\x00" * (padding * params[0] * params[1]))
+            spans.append((position / rate, (position + count + padding) / rate))
+            position += count + padding
+    return spans
+
+
+def synthesize_script(script, output_path, stats=None):
+    """
+    Sentence-level TTS of a script into output_path. Returns the sentences
+    as (text, start, end).
+    """
+    texts = split_sentences(script)
+    paths = synthesize_sentences(texts, stats)
+    spans = assemble_audio([(path, None, None) for path in paths], output_path)
+    return [(text, start, end) for text, (start, end) in zip(texts, spans)]
+
+
+def generate_script_audio(script, output_path, mode=None, stats=None):
+    """
+    Generate the voice track of a script. Returns the sentence spans, or
+    None in "script" mode.
+    """
+    mode = mode or TTS_MODE
+    if mode not in TTS_MODES:
+        raise ValueError(f"Unknown TTS mode: {mode}")
+    if mode == "script" or not split_sentences(script):
+        generate_audio(script, output_path)
+        return None
+    return synthesize_script(script, output_path, stats)
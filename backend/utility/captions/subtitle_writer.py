@@ -0,0 +1,54 @@
+import os
+
+# Supported sidecar formats
+SUBTITLE_FORMATS = ("srt", "vtt")
+
+
+def format_timestamp(seconds, separator=","):
+    """
+    Format seconds as HH:MM:SS,mmm (SRT) or HH:MM:SS.mmm (WebVTT)
+    """
+    millis = int(round(max(0.0, float(seconds)) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+def to_srt(timed_captions):
+    """
+    Convert [((start, end), text), ...] captions to SubRip text
+    """
+    blocks = []
+    for index, ((start, end), text) in enumerate(timed_captions, 1):
+        blocks.append(f"{index}\n"
+                      f"{format_timestamp(start)} --> {format_timestamp(end)}\n"
+                      f"{text}\n")
+    return "\n".join(blocks)
+
+
+def to_vtt(timed_captions):
+    """
+    Convert [((start, end), text), ...] captions to WebVTT text
+    """
+    blocks = ["WEBVTT\n"]
+    for (start, end), text in timed_captions:
+        blocks.append(f"{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}\n"
+                      f"{text}\n")
+    return "\n".join(blocks)
+
+
+def write_subtitles(timed_captions, base_path, formats=SUBTITLE_FORMATS):
+    """
+    Write caption sidecar files next to base_path (extension replaced).
+    Returns a dict mapping format to the written file path.
+    """
+    writers = {"srt": to_srt, "vtt": to_vtt}
+    root, _ = os.path.splitext(base_path)
+    paths = {}
+    for fmt in formats:
+        path = f"{root}.{fmt}"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(writers[fmt](timed_captions))
+        paths[fmt] = path
+    return paths
@@ -1,14 +1,193 @@
 import whisper_timestamped as whisper
 from whisper_timestamped import load_model, transcribe_timestamped
+from whisper.audio import load_audio, SAMPLE_RATE
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+import numpy as np
+import os
 import re
+import threading
+
+# Parallel transcription of long audio. Audio is split at quiet points into
+# overlapping windows which are transcribed in a process pool and stitched back
+# together. Short clips are always transcribed in a single call.
+CAPTIONS_PARALLEL = os.getenv("CAPTIONS_PARALLEL", "false").lower() in ("1", "true", "yes")
+CAPTIONS_WORKERS = int(os.getenv("CAPTIONS_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+CHUNK_SECONDS = float(os.getenv("CAPTIONS_CHUNK_SECONDS", 60))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("CAPTIONS_CHUNK_OVERLAP_SECONDS", 1.0))
+PARALLEL_MIN_SECONDS = float(os.getenv("CAPTIONS_PARALLEL_MIN_SECONDS", 120))
+
+# Silence detection: a cut is placed at the quietest frame within
+# SILENCE_SEARCH_SECONDS of each nominal chunk boundary.
+SILENCE_FRAME_SECONDS = 0.03
+SILENCE_SEARCH_SECONDS = 5.0
+
+# Inference backend:
+#   "torch"          - stock PyTorch Whisper through whisper_timestamped
+#   "torch-int8"     - same model with int8 dynamically quantized Linear layers
+#   "faster-whisper" - CTranslate2 runtime (int8 on CPU), optional dependency
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "torch")
+WHISPER_BACKENDS = ("torch", "torch-int8", "faster-whisper")
+
+_worker_model = None
+_worker_backend = None
+# whisper_timestamped installs hooks on the model for the duration of a call,
+# so a cached model must not be shared by concurrent transcriptions.
+_transcribe_lock = threading.Lock()
+
+
+def generate_timed_captions(audio_filename, model_size="base", parallel=None, backend=None):
+    if parallel is None:
+        parallel = CAPTIONS_PARALLEL
+    backend = backend or WHISPER_BACKEND
+
+    if parallel:
+        audio = load_audio(audio_filename)
+        if len(audio) / SAMPLE_RATE >= PARALLEL_MIN_SECONDS and CAPTIONS_WORKERS > 1:
+            return getCaptionsWithTime(transcribe_parallel(audio, model_size, backend=backend))
+
+    WHISPER_MODEL = get_model(model_size, backend)
+
+    gen = transcribe(WHISPER_MODEL, audio_filename, backend)
 
-def generate_timed_captions(audio_filename,model_size="base"):
-    WHISPER_MODEL = load_model(model_size)
-   
-    gen = transcribe_timestamped(WHISPER_MODEL, audio_filename, verbose=False, fp16=False)
-   
     return getCaptionsWithTime(gen)
 
+@lru_cache(maxsize=None)
+def get_model(model_size="base", backend="torch"):
+    """
+    Load (once per process) the Whisper model for the given backend.
+    """
+    if backend not in WHISPER_BACKENDS:
+        raise ValueError(f"Unknown whisper backend: {backend}")
+
+    if backend == "faster-whisper":
+        from faster_whisper import WhisperModel
+        return WhisperModel(model_size, device="cpu", compute_type="int8")
+
+    model = load_model(model_size, device="cpu")
+    if backend == "torch-int8":
+        import torch
+        from whisper.model import Linear as WhisperLinear
+        # whisper's Linear subclass only adds a dtype cast; quantize_dynamic
+        # only swaps plain nn.Linear modules.
+        for module in model.modules():
+            if type(module) is WhisperLinear:
+                module.__class__ = torch.nn.Linear
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+def transcribe(model, audio, backend="torch"):
+    """
+    Transcribe a file path or 16 kHz float32 array and return the
+    whisper_timestamped result structure (text, segments, words).
+    """
+    if backend != "faster-whisper":
+        with _transcribe_lock:
+            return transcribe_timestamped(model, audio, verbose=False, fp16=False)
+
+    segments, _ = model.transcribe(audio, word_timestamps=True)
+    result_segments = []
+    for i, segment in enumerate(segments):
+        words = [{'text': word.word.strip(),
+                  'start': word.start,
+                  'end': word.end,
+                  'confidence': word.probability}
+                 for word in (segment.words or []) if word.word.strip()]
+        result_segments.append({'id': i,
+                                'start': segment.start,
+                                'end': segment.end,
+                                'text': segment.text,
+                                'words': words})
+    text = "".join(segment['text'] for segment in result_segments)
+    return {'text': text, 'segments': result_segments}
+
+def find_silence_cuts(audio, chunk_seconds=CHUNK_SECONDS):
+    """
+    Return cut positions (in samples) near every chunk_seconds, snapped to the
+    quietest frame around each nominal boundary.
+    """
+    frame = int(SILENCE_FRAME_SECONDS * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+
+    search = int(SILENCE_SEARCH_SECONDS / SILENCE_FRAME_SECONDS)
+    step = int(chunk_seconds / SILENCE_FRAME_SECONDS)
+    cuts = []
+    nominal = step
+    while nominal < n_frames - search:
+        lo = max(nominal - search, (cuts[-1] // frame) + 1 if cuts else 0)
+        hi = min(nominal + search, n_frames)
+        quietest = lo + int(np.argmin(rms[lo:hi]))
+        cuts.append(quietest * frame + frame // 2)
+        nominal = quietest + step
+    return cuts
+
+def _init_worker(model_size, threads, backend):
+    global _worker_model, _worker_backend
+    import torch
+    torch.set_num_threads(threads)
+    _worker_backend = backend
+    _worker_model = get_model(model_size, backend)
+
+def _transcribe_window(audio):
+    return transcribe(_worker_model, audio, _worker_backend)
+
+def transcribe_parallel(audio, model_size="base", workers=None, backend=None):
+    """
+    Transcribe long audio as overlapping windows in a process pool and merge the
+    word timestamps into a single whisper_timestamped-shaped result.
+    """
+    workers = workers or CAPTIONS_WORKERS
+    backend = backend or WHISPER_BACKEND
+    overlap = int(CHUNK_OVERLAP_SECONDS * SAMPLE_RATE)
+    bounds = [0] + find_silence_cuts(audio) + [len(audio)]
+    cores = list(zip(bounds[:-1], bounds[1:]))
+    windows = [(max(0, start - overlap), min(len(audio), end + overlap))
+               for start, end in cores]
+
+    threads = max(1, (os.cpu_count() or workers) // workers)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(windows)), mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(model_size, threads, backend)) as pool:
+        results = list(pool.map(_transcribe_window,
+                                [audio[start:end] for start, end in windows]))
+
+    return merge_window_results(results, windows, cores)
+
+def merge_window_results(results, windows, cores):
+    """
+    Shift each window's timestamps by its offset and keep only the words whose
+    midpoint falls inside the window's core region, which removes the words
+    transcribed twice in the overlaps.
+    """
+    segments = []
+    for result, (window_start, _), (core_start, core_end) in zip(results, windows, cores):
+        offset = window_start / SAMPLE_RATE
+        core_start /= SAMPLE_RATE
+        core_end /= SAMPLE_RATE
+        for segment in result['segments']:
+            words = []
+            for word in segment.get('words', []):
+                start = word['start'] + offset
+                end = word['end'] + offset
+                if core_start <= (start + end) / 2 < core_end:
+                    words.append(dict(word, start=start, end=end))
+            if words:
+                segments.append(dict(segment,
+                                     start=words[0]['start'],
+                                     end=words[-1]['end'],
+                                     text=" ".join(w['text'] for w in words),
+                                     words=words))
+
+    text = " ".join(segment['text'] for segment in segments)
+    return {'text': text, 'segments': segments}
+
 def splitWordsBySize(words, maxCaptionSize):
    
     halfCaptionSize = maxCaptionSize / 2
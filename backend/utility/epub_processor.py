@@ -1,32 +1,225 @@
-import ebooklib
-from ebooklib import epub
-from bs4 import BeautifulSoup
-import re
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import threading
+import time
+import zipfile
+from functools import lru_cache
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+try:
+    from lxml import html as lxml_html
+    from lxml.etree import ParserError
+except ImportError:
+    lxml_html = None
+    # Only the lxml parser rejects empty documents
+    ParserError = ()
+
+# EPUB ingestion. The archive is read directly and its documents are parsed
+# one at a time in reading (spine) order, with lxml when it is installed and
+# BeautifulSoup otherwise. Parsed books are cached by a hash of the file:
+# an index with chapter titles and word counts, plus one text file per
+# chapter, so a chapter is read from disk only when it is requested.
+BOOK_CACHE_DIR = os.getenv("BOOK_CACHE_DIR", ".cache/books")
+# Minimum length (characters) for a document to be considered a chapter
+MIN_CHAPTER_CHARS = 100
+
+CONTAINER_PATH = "META-INF/container.xml"
+DOCUMENT_TYPES = ("application/xhtml+xml", "text/html")
+NAMESPACES = {
+    'container': "urn:oasis:names:tc:opendocument:xmlns:container",
+    'opf': "http://www.idpf.org/2007/opf",
+    'dc': "http://purl.org/dc/elements/1.1/"
+}
+
+_write_lock = threading.Lock()
+
+
+def parse_document(content):
+    """
+    Title (first h1/h2, if any) and whitespace-collapsed text of an
+    (X)HTML document
+    """
+    if lxml_html is not None:
+        root = lxml_html.fromstring(content)
+        for element in root.xpath("//script|//style"):
+            element.drop_tree()
+        headings = root.xpath("//h1|//h2")
+        title = headings[0].text_content() if headings else None
+        text = root.text_content()
+    else:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, 'html.parser')
+        for element in soup(['script', 'style']):
+            element.decompose()
+        heading = soup.find(['h1', 'h2'])
+        title = heading.get_text() if heading else None
+        text = soup.get_text()
+    title = " ".join(title.split()) if title else None
+    return title, " ".join(text.split())
+
+
+def read_package(archive):
+    """
+    Metadata title and document paths (in reading order) of the OPF
+    package of an open EPUB archive
+    """
+    container = ElementTree.fromstring(archive.read(CONTAINER_PATH))
+    rootfile = container.find(".//container:rootfile", NAMESPACES)
+    if rootfile is None or not rootfile.get("full-path"):
+        raise ValueError("container.xml does not point to an OPF package")
+    opf_path = rootfile.get("full-path")
+    package = ElementTree.fromstring(archive.read(opf_path))
+    base = posixpath.dirname(opf_path)
+
+    title = package.findtext(".//dc:title", default="", namespaces=NAMESPACES).strip()
+    manifest = {}
+    for item in package.iterfind(".//opf:manifest/opf:item", NAMESPACES):
+        if item.get("media-type") in DOCUMENT_TYPES:
+            manifest[item.get("id")] = posixpath.normpath(
+                posixpath.join(base, unquote(item.get("href"))))
+    spine = [manifest[itemref.get("idref")]
+             for itemref in package.iterfind(".//opf:spine/opf:itemref", NAMESPACES)
+             if itemref.get("idref") in manifest]
+    # Fall back to manifest order for packages without a usable spine
+    return title, spine or list(manifest.values())
+
+
+def iter_chapters(epub_file):
+    """
+    Yield the chapters of an EPUB one document at a time, as dicts with
+    title, content and source (the document's path in the archive)
+    """
+    with zipfile.ZipFile(epub_file) as archive:
+        _, documents = read_package(archive)
+        number = 0
+        for path in documents:
+            try:
+                content = archive.read(path)
+            except KeyError:
+                print(f"Warning: {path} is listed in the package but missing from the archive")
+                continue
+            try:
+                title, text = parse_document(content)
+            except ParserError:
+                # Blank pages (no content, or only a declaration/comment)
+                continue
+            # Only include non-empty chapters
+            if len(text) > MIN_CHAPTER_CHARS:
+                number += 1
+                yield {
+                    'title': title or f"Chapter {number}",
+                    'content': text,
+                    'source': path
+                }
 
 
 def read_epub(epub_file):
     """Process EPUB file and extract chapters"""
-    book = epub.read_epub(epub_file)
-    chapters = []
+    return [{'title': chapter['title'], 'content': chapter['content']}
+            for chapter in iter_chapters(epub_file)]
 
-    for item in book.get_items():
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            # Parse HTML content
-            soup = BeautifulSoup(item.get_content(), 'html.parser')
 
-            # Extract text content
-            text = soup.get_text()
-            text = re.sub(r'\s+', ' ', text).strip()
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-            # Only include non-empty chapters
-            if text and len(text) > 100:  # Minimum length to be considered a chapter
-                chapter_title = soup.find(['h1', 'h2'])
-                title = chapter_title.get_text().strip(
-                ) if chapter_title else f"Chapter {len(chapters) + 1}"
 
-                chapters.append({
-                    'title': title,
-                    'content': text
-                })
+def book_dir(book_id):
+    if not book_id.isalnum():
+        raise ValueError(f"Invalid book id: {book_id}")
+    return os.path.join(BOOK_CACHE_DIR, book_id)
+
+
+def ingest_book(epub_file, filename=None):
+    """
+    Parse an EPUB into the book cache, unless the same file was ingested
+    before. Returns the book index (no chapter text).
+    """
+    book_id = file_hash(epub_file)[:32]
+    index = get_book(book_id)
+    if index is not None:
+        return index
+
+    target = book_dir(book_id)
+    tmp_dir = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        with zipfile.ZipFile(epub_file) as archive:
+            title, _ = read_package(archive)
+        chapters = []
+        # Each chapter is written out as soon as it is parsed
+        for number, chapter in enumerate(iter_chapters(epub_file), start=1):
+            chapter_id = str(number)
+            with open(os.path.join(tmp_dir, f"{chapter_id}.txt"), "w", encoding="utf-8") as f:
+                f.write(chapter['content'])
+            chapters.append({'id': chapter_id,
+                             'title': chapter['title'],
+                             'word_count': len(chapter['content'].split()),
+                             'source': chapter['source']})
+        index = {
+            'book_id': book_id,
+            'title': title or os.path.splitext(filename or "")[0] or "Untitled",
+            'filename': filename,
+            'created_at': time.time(),
+            'word_count': sum(chapter['word_count'] for chapter in chapters),
+            'chapters': chapters
+        }
+        with open(os.path.join(tmp_dir, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        with _write_lock:
+            if not os.path.exists(target):
+                os.replace(tmp_dir, target)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return get_book(book_id)
+
+
+@lru_cache(maxsize=256)
+def _load_index(index_path, mtime_ns):
+    with open(index_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def get_book(book_id):
+    """
+    Index of a cached book (title and chapter list), or None
+    """
+    if not book_id.isalnum():
+        return None
+    index_path = os.path.join(book_dir(book_id), "index.json")
+    try:
+        return _load_index(index_path, os.stat(index_path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def list_books():
+    if not os.path.isdir(BOOK_CACHE_DIR):
+        return []
+    books = []
+    for name in sorted(os.listdir(BOOK_CACHE_DIR)):
+        book = get_book(name)
+        if book is not None:
+            books.append(book)
+    return books
+
 
-    return chapters
+def get_chapter(book_id, chapter_id):
+    """
+    A chapter of a cached book with its text, or None
+    """
+    book = get_book(book_id)
+    if book is None:
+        return None
+    for chapter in book['chapters']:
+        if chapter['id'] == chapter_id:
+            with open(os.path.join(book_dir(book_id), f"{chapter_id}.txt"), encoding="utf-8") as f:
+                return dict(chapter, content=f.read())
+    return None
@@ -0,0 +1,229 @@
+import os
+import tempfile
+from difflib import SequenceMatcher
+from utility.audio.sentence_audio import (assemble_audio, record_stats, split_sentences,
+                                          synthesize_sentences)
+from utility.captions.timed_captions_generator import generate_timed_captions
+from utility.video.background_video_generator import generate_video_url
+from utility.video.video_search_query_generator import (getVideoSearchQueriesTimed,
+                                                        merge_empty_intervals)
+
+# Incremental re-render of an edited script. The new script is diffed
+# against a finished job sentence by sentence. Unchanged sentences keep
+# their audio (cut from the base job's voice track), and the captions,
+# search terms and background clips that lie entirely within a run of
+# unchanged sentences are shifted to their new position. Only the gaps
+# left around changed sentences are synthesized, transcribed and searched.
+
+# Tolerance when deciding whether an item lies within an unchanged run
+EDGE_TOLERANCE = 0.01
+# Uncovered stretches shorter than this are left alone
+MIN_GAP_SECONDS = 0.05
+
+REQUIRED_ARTIFACTS = ('sentences', 'audio_file', 'timed_captions', 'search_terms',
+                      'background_video_urls')
+
+
+def can_edit(base_artifacts):
+    """
+    Whether a job kept what an incremental edit needs (sentence-level audio
+    and the results of every stage)
+    """
+    return (all(base_artifacts.get(key) is not None for key in REQUIRED_ARTIFACTS)
+            and os.path.exists(base_artifacts['audio_file']))
+
+
+def unchanged_runs(base_sentences, texts):
+    """
+    Match the new sentences against the base job's. Returns the opcodes of
+    the diff (difflib) on sentence texts.
+    """
+    matcher = SequenceMatcher(a=[text for text, _, _ in base_sentences], b=texts,
+                              autojunk=False)
+    return matcher.get_opcodes()
+
+
+def keep_within(items, runs, span_of, shift):
+    """
+    Items entirely within one of the runs (base_start, base_end, delta),
+    shifted by that run's delta. Also returns the new positions of the
+    parts of dropped items that lay within a run, which are left uncovered.
+    """
+    kept = []
+    uncovered = []
+    for item in items:
+        start, end = span_of(item)
+        for base_start, base_end, delta in runs:
+            if start >= base_start - EDGE_TOLERANCE and end <= base_end + EDGE_TOLERANCE:
+                kept.append(shift(item, delta))
+                break
+        else:
+            # Straddles a changed or deleted sentence
+            for base_start, base_end, delta in runs:
+                if start < base_end and end > base_start:
+                    uncovered.append((max(start, base_start) + delta,
+                                      min(end, base_end) + delta))
+    return kept, uncovered
+
+
+def find_gaps(spans, total_duration, changed_spans=None):
+    """
+    Stretches of [0, total_duration] not covered by any of the spans. With
+    changed_spans, only those that overlap a changed sentence (the rest is
+    silence between sentences).
+    """
+    gaps = []
+    cursor = 0.0
+    for start, end in sorted(spans):
+        if start - cursor > MIN_GAP_SECONDS:
+            gaps.append((cursor, start))
+        cursor = max(cursor, end)
+    if total_duration - cursor > MIN_GAP_SECONDS:
+        gaps.append((cursor, total_duration))
+    if changed_spans is None:
+        return gaps
+    return [(start, end) for start, end in gaps
+            if any(start < changed_end and end > changed_start
+                   for changed_start, changed_end in changed_spans)]
+
+
+def close_holes(segments, total_duration):
+    """
+    Stretch [start, end, ...] segments (sorted, non-overlapping) so they
+    cover [0, total_duration] back to back; the renderer joins segments by
+    duration, so a hole would shift every later clip
+    """
+    for previous, segment in zip(segments, segments[1:]):
+        previous[1] = segment[0]
+    if segments:
+        segments[0][0] = 0.0
+        segments[-1][1] = total_duration
+    return segments
+
+
+def shift_caption(caption, delta):
+    (start, end), text = caption
+    return ((start + delta, end + delta), text)
+
+
+def shift_segment(segment, delta):
+    return [segment[0] + delta, segment[1] + delta] + list(segment[2:])
+
+
+def transcribe_gaps(audio_file, gaps):
+    """
+    Transcribe only the given stretches of the voice track
+    """
+    captions = []
+    with tempfile.TemporaryDirectory(prefix="edit_") as work_dir:
+        for i, (start, end) in enumerate(gaps):
+            gap_path = os.path.join(work_dir, f"gap_{i}.wav")
+            assemble_audio([(audio_file, start, end)], gap_path)
+            for (caption_start, caption_end), text in generate_timed_captions(gap_path):
+                if caption_start + start < end:
+                    captions.append(((caption_start + start, min(caption_end + start, end)), text))
+    return captions
+
+
+def search_gaps(script, timed_captions, gaps, keyword_mode=None, stats=None):
+    """
+    Search terms for the captions in each gap, with the first and last
+    segment stretched to the gap's edges
+    """
+    segments = []
+    for start, end in gaps:
+        captions = [caption for caption in timed_captions
+                    if caption[0][0] < end and caption[0][1] > start + EDGE_TOLERANCE]
+        if not captions:
+            continue
+        gap_segments = getVideoSearchQueriesTimed(script, captions, keyword_mode=keyword_mode,
+                                                  stats=stats)
+        if not gap_segments:
+            continue
+        gap_segments[0][0] = start
+        gap_segments[-1][1] = end
+        segments.extend(gap_segments)
+    return segments
+
+
+def plan_edit(base_artifacts, script, audio_file, video_server=None, keyword_mode=None,
+              stats=None):
+    """
+    Build the artifacts (audio, sentences, captions, search terms and
+    background clips) of an edited script from a finished job's. Returns
+    None when the base job cannot be reused.
+    """
+    if not can_edit(base_artifacts):
+        return None
+    base_sentences = base_artifacts['sentences']
+    texts = split_sentences(script)
+    if not texts:
+        return None
+    opcodes = unchanged_runs(base_sentences, texts)
+
+    # Voice track: unchanged sentences are cut from the base audio, the
+    # others come from (cached) sentence TTS
+    changed = [j for tag, _, _, j1, j2 in opcodes if tag != "equal" for j in range(j1, j2)]
+    tts_stats = {}
+    changed_paths = dict(zip(changed, synthesize_sentences([texts[j] for j in changed],
+                                                           tts_stats)))
+    pieces = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            pieces += [(base_artifacts['audio_file'], start, end)
+                       for _, start, end in base_sentences[i1:i2]]
+        else:
+            pieces += [(changed_paths[j], None, None) for j in range(j1, j2)]
+    spans = assemble_audio(pieces, audio_file)
+    sentences = [(text, start, end) for text, (start, end) in zip(texts, spans)]
+    total_duration = spans[-1][1]
+    changed_spans = [spans[j] for j in changed]
+
+    # Runs of unchanged sentences as (base_start, base_end, delta)
+    runs = [(base_sentences[i1][1], base_sentences[i2 - 1][2],
+             sentences[j1][1] - base_sentences[i1][1])
+            for tag, i1, i2, j1, j2 in opcodes if tag == "equal"]
+
+    # Gaps are transcribed where a sentence changed, and where a caption that
+    # straddled a changed or deleted sentence was dropped
+    kept_captions, uncovered = keep_within(base_artifacts['timed_captions'], runs,
+                                           lambda caption: caption[0], shift_caption)
+    caption_gaps = find_gaps([caption[0] for caption in kept_captions], total_duration,
+                             changed_spans + uncovered)
+    new_captions = transcribe_gaps(audio_file, caption_gaps) if caption_gaps else []
+    timed_captions = sorted(kept_captions + new_captions, key=lambda caption: caption[0][0])
+
+    kept_terms, _ = keep_within(base_artifacts['search_terms'], runs,
+                                lambda segment: (segment[0], segment[1]), shift_segment)
+    # Search terms and clips must cover the whole timeline, so every gap is
+    # filled, not only those at changed sentences
+    term_gaps = find_gaps([(segment[0], segment[1]) for segment in kept_terms], total_duration)
+    new_terms = search_gaps(script, timed_captions, term_gaps, keyword_mode) if term_gaps else []
+    search_terms = close_holes(sorted(kept_terms + new_terms, key=lambda segment: segment[0]),
+                               total_duration)
+
+    kept_urls, _ = keep_within(base_artifacts['background_video_urls'], runs,
+                               lambda segment: (segment[0], segment[1]), shift_segment)
+    new_urls = (merge_empty_intervals(generate_video_url(new_terms, video_server)) or []
+                if new_terms else [])
+    background_video_urls = close_holes(sorted(kept_urls + new_urls,
+                                               key=lambda segment: segment[0]),
+                                        total_duration)
+
+    record_stats(stats,
+                 sentences_reused=len(texts) - len(changed),
+                 sentences_synthesized=tts_stats.get('synthesized', 0),
+                 sentences_cached=tts_stats.get('cached', 0),
+                 captions_reused=len(kept_captions),
+                 captions_transcribed=len(new_captions),
+                 search_segments_reused=len(kept_terms),
+                 search_segments_new=len(new_terms),
+                 clips_reused=len(kept_urls),
+                 clips_new=len(new_urls))
+    return {
+        'audio_file': audio_file,
+        'sentences': sentences,
+        'timed_captions': timed_captions,
+        'search_terms': search_terms,
+        'background_video_urls': background_video_urls
+    }
@@ -0,0 +1,237 @@
+"""
+Single entry point for every LLM request made by the pipeline.
+
+- one pooled, keep-alive client per provider
+- per-model token-bucket rate limits and concurrency caps
+- jittered exponential retry on 429 / 5xx / connection errors
+- disk-backed response cache keyed by provider, model, messages and parameters
+- per-model latency, token and cache metrics
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import httpx
+from openai import OpenAI
+
+PROVIDER_OPENAI = "openai"
+PROVIDER_GROQ = "groq"
+
+# Defaults applied to every model; LLM_MODEL_LIMITS overrides them per model,
+# e.g. '{"gpt-4": {"rpm": 20, "concurrency": 2}}'
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 60))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MODEL_LIMITS = json.loads(os.getenv("LLM_MODEL_LIMITS", "{}"))
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", 1.0))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", 30.0))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 120))
+
+LLM_CACHE = os.getenv("LLM_CACHE", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".cache/llm")
+
+_clients = {}
+_clients_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Blocking token bucket refilled at rate tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ModelLimiter:
+    """Rate limit and concurrency cap for a single model."""
+
+    def __init__(self, requests_per_minute, concurrency):
+        self.bucket = TokenBucket(requests_per_minute / 60.0,
+                                  max(1.0, min(concurrency, requests_per_minute)))
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        self.bucket.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+        return False
+
+
+def get_client(provider=PROVIDER_OPENAI):
+    """
+    Return the shared client for a provider. Clients keep their HTTP
+    connections alive and never retry on their own; retries happen here.
+    """
+    with _clients_lock:
+        if provider not in _clients:
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY * 4,
+                                    max_keepalive_connections=LLM_MAX_CONCURRENCY * 2),
+                timeout=LLM_TIMEOUT_SECONDS)
+            if provider == PROVIDER_GROQ:
+                from groq import Groq
+                _clients[provider] = Groq(api_key=os.environ.get("GROQ_API_KEY"),
+                                          http_client=http_client, max_retries=0)
+            elif provider == PROVIDER_OPENAI:
+                _clients[provider] = OpenAI(http_client=http_client, max_retries=0)
+            else:
+                raise ValueError(f"Unknown LLM provider: {provider}")
+        return _clients[provider]
+
+
+def get_limiter(model):
+    with _limiters_lock:
+        if model not in _limiters:
+            limits = LLM_MODEL_LIMITS.get(model, {})
+            _limiters[model] = ModelLimiter(limits.get("rpm", LLM_REQUESTS_PER_MINUTE),
+                                            limits.get("concurrency", LLM_MAX_CONCURRENCY))
+        return _limiters[model]
+
+
+def _record(model, **values):
+    with _metrics_lock:
+        stats = _metrics.setdefault(model, {
+            "requests": 0, "cache_hits": 0, "errors": 0, "retries": 0,
+            "latency_total": 0.0, "latency_max": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+        })
+        for key, value in values.items():
+            if key == "latency":
+                stats["latency_total"] += value
+                stats["latency_max"] = max(stats["latency_max"], value)
+            else:
+                stats[key] += value
+
+
+def get_metrics():
+    """
+    Per-model request, cache, retry, latency and token counters
+    """
+    with _metrics_lock:
+        metrics = {}
+        for model, stats in _metrics.items():
+            stats = dict(stats)
+            stats["latency_avg"] = stats["latency_total"] / stats["requests"] if stats["requests"] else 0.0
+            metrics[model] = stats
+        return metrics
+
+
+def _is_retryable(error):
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def _retry_delay(error, attempt):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(LLM_RETRY_MAX_SECONDS, float(retry_after)) + random.uniform(0, 1)
+    except (TypeError, ValueError):
+        # Full jitter exponential backoff
+        return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def _cache_path(key):
+    return os.path.join(LLM_CACHE_DIR, key[:2], f"{key}.json")
+
+
+def _cache_get(key):
+    try:
+        with open(_cache_path(key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_put(key, value):
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _create(provider, model, messages, cache, extract, **kwargs):
+    key = None
+    if cache and LLM_CACHE:
+        key = hashlib.sha256(json.dumps(
+            {"provider": provider, "model": model, "messages": messages, "params": kwargs},
+            sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        cached = _cache_get(key)
+        if cached is not None:
+            _record(model, cache_hits=1)
+            return cached["result"]
+
+    client = get_client(provider)
+    limiter = get_limiter(model)
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            with limiter:
+                response = client.chat.completions.create(model=model, messages=messages, **kwargs)
+        except Exception as e:
+            _record(model, errors=1)
+            if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            print(f"LLM request to {model} failed ({e}); retrying in {delay:.1f}s")
+            _record(model, retries=1)
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        usage = getattr(response, "usage", None)
+        _record(model, requests=1, latency=time.perf_counter() - start,
+                prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+        result = extract(response)
+        if key is not None:
+            _cache_put(key, {"model": model, "result": result})
+        return result
+
+
+def chat(messages, model, provider=PROVIDER_OPENAI, cache=True, **kwargs):
+    """
+    Run a chat completion and return the message text. Pass cache=False
+    for sampled calls whose output should vary between requests.
+    """
+    return _create(provider, model, messages, cache,
+                   lambda response: response.choices[0].message.content, **kwargs)
+
+
+def chat_audio(messages, model, provider=PROVIDER_OPENAI, cache=True, **kwargs):
+    """
+    Run an audio-modality chat completion and return the base64 audio data
+    """
+    return _create(provider, model, messages, cache,
+                   lambda response: response.choices[0].message.audio.data, **kwargs)
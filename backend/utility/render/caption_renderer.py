@@ -0,0 +1,123 @@
+import os
+from functools import lru_cache
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# In-process caption rasterizer. Captions are drawn with Pillow instead of
+# ImageMagick (moviepy's TextClip), and each distinct caption is rendered
+# once and kept as an RGBA array.
+CAPTION_FONT = os.getenv("CAPTION_FONT", "Arial")
+# Font file; when unset CAPTION_FONT is looked up by name
+CAPTION_FONT_FILE = os.getenv("CAPTION_FONT_FILE")
+CAPTION_FONT_SIZE = 60
+# Caption layout is designed for a 1080x1920 frame and scaled to the output
+CAPTION_REFERENCE_SIZE = (1080, 1920)
+CAPTION_MARGIN = 100
+CAPTION_BOTTOM_OFFSET = 300
+# Rendered caption images kept in memory
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", 1024))
+
+FALLBACK_FONTS = (
+    "DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/Library/Fonts/Arial.ttf",
+)
+
+
+@lru_cache(maxsize=None)
+def get_font(font, size):
+    """
+    Load a TrueType font by file path or name, once per (font, size)
+    """
+    candidates = [font, f"{font}.ttf", f"{font.lower()}.ttf"] + list(FALLBACK_FONTS)
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    print(f"Warning: font {font} not found, using Pillow's default font")
+    return ImageFont.load_default(size)
+
+
+def caption_layout(width, height):
+    """
+    Font size, caption box width and top offset for a width x height frame
+    """
+    scale_x = width / CAPTION_REFERENCE_SIZE[0]
+    scale_y = height / CAPTION_REFERENCE_SIZE[1]
+    return (round(CAPTION_FONT_SIZE * scale_y),
+            width - round(CAPTION_MARGIN * scale_x),
+            height - round(CAPTION_BOTTOM_OFFSET * scale_y))
+
+
+def wrap_text(text, font, max_width):
+    """
+    Greedy word wrap by rendered width
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+@lru_cache(maxsize=CAPTION_CACHE_SIZE)
+def render_caption(text, width, fontsize=CAPTION_FONT_SIZE, color="white", bg_color="black",
+                   font=None, align="center", line_spacing=4):
+    """
+    Rasterize a caption into a read-only RGBA array of the given width,
+    with the text wrapped to fit and the background filling the whole box
+    (like TextClip's "caption" method). Results are cached by text and style.
+    """
+    pil_font = get_font(font or CAPTION_FONT_FILE or CAPTION_FONT, fontsize)
+    lines = wrap_text(text, pil_font, width)
+    ascent, descent = pil_font.getmetrics()
+    line_height = ascent + descent
+    height = max(1, line_height * len(lines) + line_spacing * (len(lines) - 1))
+
+    background = ImageColor.getrgb(bg_color) + (255,) if bg_color else (0, 0, 0, 0)
+    image = Image.new("RGBA", (width, height), background)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        line_width = pil_font.getlength(line)
+        if align == "center":
+            x = (width - line_width) / 2
+        elif align == "right":
+            x = width - line_width
+        else:
+            x = 0
+        draw.text((x, i * (line_height + line_spacing)), line, font=pil_font, fill=color)
+
+    array = np.asarray(image)
+    array.flags.writeable = False
+    return array
+
+
+def make_caption_clip(text, width, **style):
+    """
+    moviepy ImageClip (with an alpha mask) for a cached caption image
+    """
+    from moviepy.editor import ImageClip
+    rgba = render_caption(text, width, **style)
+    clip = ImageClip(rgba[:, :, :3])
+    return clip.set_mask(ImageClip(rgba[:, :, 3] / 255.0, ismask=True))
+
+
+def get_stats():
+    info = render_caption.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'cached': info.currsize,
+        'max_cached': info.maxsize,
+        'hit_rate': info.hits / lookups if lookups else 0.0
+    }
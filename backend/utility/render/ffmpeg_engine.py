@@ -0,0 +1,145 @@
+import os
+import subprocess
+import tempfile
+import textwrap
+from moviepy.config import get_setting
+from utility.video.clip_ingest import proxy_filter
+from utility.render.caption_renderer import CAPTION_FONT, CAPTION_FONT_FILE, caption_layout
+from utility.render.hls_output import reset_dir, tee_output_args
+from utility.tracer import span
+
+# Renders the whole video in one native ffmpeg pass: the segments, caption
+# overlays and audio mix are compiled into a single filter_complex instead
+# of pulling every frame through Python.
+
+# Roughly the number of characters per caption line (the font scales with
+# the frame, so this does not depend on the output size)
+CAPTION_WRAP_CHARS = int(os.getenv("CAPTION_WRAP_CHARS", 28))
+
+
+def escape_filter_value(value):
+    """
+    Prepare a value for use inside a single-quoted filtergraph option
+    """
+    return value.replace("\\", "/").replace("'", "'\\''")
+
+
+def cover_timeline(segments, total_duration):
+    """
+    Repeat the segment list until it covers total_duration, the same way the
+    moviepy engine loops the concatenated background
+    """
+    covered = sum(duration for _, _, duration in segments)
+    timeline = list(segments)
+    i = 0
+    while covered < total_duration and segments:
+        timeline.append(segments[i % len(segments)])
+        covered += segments[i % len(segments)][2]
+        i += 1
+    return timeline
+
+
+def write_caption_files(work_dir, timed_captions):
+    """
+    Write each caption, wrapped, to its own file for drawtext's textfile
+    option (avoids escaping arbitrary text inside the filtergraph)
+    """
+    caption_files = []
+    for i, (_, text) in enumerate(timed_captions):
+        path = os.path.join(work_dir, f"caption_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(textwrap.wrap(text, CAPTION_WRAP_CHARS)) or " ")
+        caption_files.append(path)
+    return caption_files
+
+
+def audio_filtergraph(voice_input, music_input, voice_volume, music_volume):
+    # amix divides by the number of inputs; scale back up so the voice and
+    # music are summed like CompositeAudioClip does
+    return "\n".join([
+        f"[{voice_input}:a]volume={voice_volume}[voice];",
+        f"[{music_input}:a]volume={music_volume}[music];",
+        "[voice][music]amix=inputs=2:duration=first:dropout_transition=0,volume=2[aout]"])
+
+
+def build_filtergraph(segments, timed_captions, caption_files, width, height, fps,
+                      voice_volume=1.0, music_volume=0.05, voice_input=None, music_input=None):
+    """
+    Build the filter_complex script. segments[i] is read from input i; the
+    audio mix is added when voice_input and music_input are given.
+    """
+    lines = []
+    for i in range(len(segments)):
+        lines.append(f"[{i}:v]{proxy_filter(width, height, fps)},format=yuv420p,"
+                     f"setpts=PTS-STARTPTS[v{i}];")
+    lines.append("".join(f"[v{i}]" for i in range(len(segments))) +
+                 f"concat=n={len(segments)}:v=1:a=0[bg];")
+
+    last = "bg"
+    if caption_files:
+        fontsize, _, top = caption_layout(width, height)
+        if CAPTION_FONT_FILE:
+            font = f"fontfile='{escape_filter_value(CAPTION_FONT_FILE)}'"
+        else:
+            font = f"font='{escape_filter_value(CAPTION_FONT)}'"
+        for i, (((start, end), _), text_file) in enumerate(zip(timed_captions, caption_files)):
+            lines.append(
+                f"[{last}]drawtext={font}:textfile='{escape_filter_value(text_file)}':"
+                f"fontsize={fontsize}:fontcolor=white:box=1:boxcolor=black:"
+                f"x=(w-text_w)/2:y={top}:"
+                f"enable='between(t,{start:.3f},{end:.3f})'[c{i}];")
+            last = f"c{i}"
+    lines.append(f"[{last}]null[vout]" + (";" if voice_input is not None else ""))
+
+    if voice_input is not None:
+        lines.append(audio_filtergraph(voice_input, music_input, voice_volume, music_volume))
+    return "\n".join(lines)
+
+
+def render_ffmpeg(segments, audio_file, background_music_path, timed_captions, total_duration,
+                  output_path, width, height, fps, voice_volume=1.0, music_volume=0.05,
+                  burn_captions=True, threads=4, preset="medium", crf=23, audio_bitrate=None,
+                  hls_dir=None):
+    """
+    Render the video with a single ffmpeg invocation.
+
+    segments is a list of (path, offset, duration) in timeline order.
+    Captions are drawn with drawtext when burn_captions is set. With hls_dir
+    the same encode also feeds an HLS playlist there while it runs.
+    """
+    if not segments:
+        raise ValueError("No background segments to render")
+    timeline = cover_timeline(segments, total_duration)
+
+    with tempfile.TemporaryDirectory(prefix="render_") as work_dir:
+        caption_files = write_caption_files(work_dir, timed_captions) if burn_captions else []
+
+        command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error"]
+        for path, offset, duration in timeline:
+            # Looping the input covers clips shorter than their segment
+            command += ["-stream_loop", "-1", "-ss", f"{offset:.3f}", "-t", f"{duration:.3f}",
+                        "-i", path]
+        voice_input = len(timeline)
+        music_input = voice_input + 1
+        command += ["-i", audio_file, "-stream_loop", "-1", "-i", background_music_path]
+
+        script_path = os.path.join(work_dir, "filtergraph.txt")
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(build_filtergraph(timeline, timed_captions, caption_files, width, height, fps,
+                                      voice_volume, music_volume, voice_input, music_input))
+
+        command += ["-filter_complex_script", script_path,
+                    "-map", "[vout]", "-map", "[aout]",
+                    "-t", f"{total_duration:.3f}",
+                    "-r", str(fps),
+                    "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+                    "-c:a", "aac", *(["-b:a", audio_bitrate] if audio_bitrate else []),
+                    "-threads", str(threads)]
+        if hls_dir:
+            reset_dir(hls_dir)
+            command += tee_output_args(output_path, hls_dir)
+        else:
+            command += ["-movflags", "+faststart", output_path]
+        with span("render.encode", "render", segments=len(timeline)):
+            subprocess.run(command, check=True)
+    return output_path
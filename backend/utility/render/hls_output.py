@@ -0,0 +1,106 @@
+import math
+import os
+import shutil
+import subprocess
+from moviepy.config import get_setting
+
+# Progressive output: next to the MP4 the render publishes an HLS playlist
+# whose MPEG-TS segments appear as they are encoded, so playback can start
+# before the render has finished. The playlist is an EVENT playlist until
+# the render completes, then it is closed with EXT-X-ENDLIST.
+HLS_SEGMENT_SECONDS = float(os.getenv("HLS_SEGMENT_SECONDS", 4))
+HLS_PLAYLIST = "index.m3u8"
+HLS_SEGMENT_PATTERN = "segment_%05d.ts"
+
+
+def reset_dir(hls_dir):
+    """
+    Empty the HLS directory, e.g. before a fallback render starts over
+    """
+    shutil.rmtree(hls_dir, ignore_errors=True)
+    os.makedirs(hls_dir, exist_ok=True)
+
+
+def keyframe_args(seconds=None):
+    """
+    Encoder args forcing a keyframe at every segment boundary
+    """
+    return ["-force_key_frames", f"expr:gte(t,n_forced*{seconds or HLS_SEGMENT_SECONDS})"]
+
+
+def escape_tee(value):
+    for char in ("\\", ":", "|", "[", "]"):
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def tee_output_args(output_path, hls_dir, seconds=None):
+    """
+    Output args writing the faststart MP4 and the HLS playlist from a
+    single encode (ffmpeg's tee muxer). They replace the output path.
+    """
+    seconds = seconds or HLS_SEGMENT_SECONDS
+    hls_dir = hls_dir.replace("\\", "/")
+    segments = escape_tee(f"{hls_dir}/{HLS_SEGMENT_PATTERN}")
+    return [*keyframe_args(seconds), "-flags", "+global_header", "-f", "tee",
+            f"[f=mp4:movflags=+faststart]{escape_tee(output_path)}|"
+            f"[f=hls:hls_time={seconds}:hls_playlist_type=event:hls_segment_filename={segments}]"
+            f"{escape_tee(hls_dir + '/' + HLS_PLAYLIST)}"]
+
+
+def segment_video(video_path, hls_dir, seconds=None):
+    """
+    Cut a finished MP4 into an HLS playlist without re-encoding
+    """
+    reset_dir(hls_dir)
+    subprocess.run([
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-i", video_path,
+        "-map", "0:v", "-map", "0:a?", "-c", "copy",
+        "-f", "hls", "-hls_time", str(seconds or HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(hls_dir, HLS_SEGMENT_PATTERN),
+        os.path.join(hls_dir, HLS_PLAYLIST)
+    ], check=True)
+    return os.path.join(hls_dir, HLS_PLAYLIST)
+
+
+class HlsPlaylist:
+    """
+    EVENT playlist written by the renderer itself as segments are added.
+    Every update replaces the playlist file atomically.
+    """
+
+    def __init__(self, hls_dir, target_duration):
+        self.hls_dir = hls_dir
+        self.path = os.path.join(hls_dir, HLS_PLAYLIST)
+        self.target_duration = max(1, math.ceil(target_duration))
+        self.segments = []
+        reset_dir(hls_dir)
+        self.write()
+
+    def segment_path(self, index):
+        return os.path.join(self.hls_dir, HLS_SEGMENT_PATTERN % index)
+
+    def add(self, segment_path, duration):
+        self.segments.append((os.path.basename(segment_path), duration))
+        self.write()
+
+    def finish(self):
+        self.write(ended=True)
+        return self.path
+
+    def write(self, ended=False):
+        lines = ["#EXTM3U",
+                 "#EXT-X-VERSION:3",
+                 f"#EXT-X-TARGETDURATION:{self.target_duration}",
+                 "#EXT-X-MEDIA-SEQUENCE:0",
+                 "#EXT-X-PLAYLIST-TYPE:EVENT"]
+        for name, duration in self.segments:
+            lines += [f"#EXTINF:{duration:.3f},", name]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
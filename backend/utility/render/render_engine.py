@@ -4,22 +4,29 @@ import tempfile
 import zipfile
 import platform
 import subprocess
-from moviepy.editor import (AudioFileClip, CompositeVideoClip, CompositeAudioClip, ImageClip,
-                            TextClip, VideoFileClip, concatenate_videoclips)
-from moviepy.audio.fx.audio_loop import audio_loop
 from moviepy.audio.fx.audio_normalize import audio_normalize
-import requests
-from moviepy.config import change_settings
-from tqdm import tqdm
+from moviepy.config import change_settings, get_setting
 from PIL import Image
 from utility.theme.theme_analyzer import analyze_theme
-
-# Configure ImageMagick binary path
-magick_path = r"C:\Program Files\ImageMagick-7.1.1-Q16-HDRI\magick.exe"
-if os.path.exists(magick_path):
-    change_settings({"IMAGEMAGICK_BINARY": magick_path})
-else:
-    print("Warning: ImageMagick not found at expected path. Please ensure ImageMagick is installed correctly.")
+from utility.captions.subtitle_writer import write_subtitles
+from utility.video.download_manager import DownloadManager
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from utility.video.clip_ingest import CLIP_PROXIES, make_proxy
+from utility.render.ffmpeg_engine import render_ffmpeg
+from utility.render.segment_render import render_segments_parallel
+from utility.render.hls_output import keyframe_args, reset_dir, segment_video
+from utility.render.streaming_timeline import StreamingTimeline
+from utility.audio.audio_mixer import mix_audio
+from utility.tracer import span
+
+# Captions are rasterized with Pillow (caption_renderer), so ImageMagick is
+# only needed by code that still uses moviepy's TextClip
+magick_path = os.getenv("IMAGEMAGICK_BINARY")
+if magick_path:
+    if os.path.exists(magick_path):
+        change_settings({"IMAGEMAGICK_BINARY": magick_path})
+    else:
+        print(f"Warning: ImageMagick not found at {magick_path}")
 
 # Update Pillow's resize method
 Image.ANTIALIAS = Image.Resampling.LANCZOS
@@ -27,11 +34,60 @@ Image.ANTIALIAS = Image.Resampling.LANCZOS
 # Video dimensions for portrait mode
 VIDEO_WIDTH = 1080
 VIDEO_HEIGHT = 1920
+VIDEO_FPS = 30
 
 # Audio settings
 VOICE_VOLUME = 1.0  # 100% volume for voice
 BACKGROUND_MUSIC_VOLUME = 0.05  # 20% volume for background music
 
+# Caption output modes:
+#   "burn"    - captions are composited into every frame (default)
+#   "sidecar" - captions are written as .srt/.vtt files next to the video
+#   "soft"    - sidecars plus a mov_text subtitle track muxed into the MP4
+CAPTION_MODES = ("burn", "sidecar", "soft")
+CAPTION_MODE = os.getenv("CAPTION_MODE", "burn")
+
+# Output modes:
+#   "mp4" - a faststart MP4, available once the render finishes (default)
+#   "hls" - the MP4 plus an HLS playlist that fills up while rendering. The
+#           ffmpeg engines publish segments as they encode; moviepy renders
+#           are segmented when they finish.
+OUTPUT_MODES = ("mp4", "hls")
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "mp4")
+
+# Render engines:
+#   "moviepy" - frames are composited in Python (default)
+#   "ffmpeg"  - one native ffmpeg pass over a generated filtergraph
+#   "parallel" - background segments encoded as parts in parallel ffmpeg
+#               processes, joined by stream copy
+# The ffmpeg-based engines fall back to moviepy if they fail.
+RENDER_ENGINES = ("moviepy", "ffmpeg", "parallel")
+RENDER_ENGINE = os.getenv("RENDER_ENGINE", "moviepy")
+
+# Render profiles: output size, frame rate and encoder settings. "draft" is
+# a quick preview for checking the footage; a draft job can be promoted to
+# a full render that reuses its audio, captions and clips.
+RENDER_PROFILES = {
+    "draft": {"width": 540, "height": 960, "fps": 24,
+              "preset": "ultrafast", "crf": 30, "audio_bitrate": "96k"},
+    "standard": {"width": VIDEO_WIDTH, "height": VIDEO_HEIGHT, "fps": VIDEO_FPS,
+                 "preset": "medium", "crf": 23, "audio_bitrate": "192k"},
+    "archival": {"width": VIDEO_WIDTH, "height": VIDEO_HEIGHT, "fps": VIDEO_FPS,
+                 "preset": "slow", "crf": 16, "audio_bitrate": "320k"},
+}
+RENDER_PROFILE = os.getenv("RENDER_PROFILE", "standard")
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Encoder threads; 0 uses every core available to the process
+RENDER_THREADS = int(os.getenv("RENDER_THREADS", 0)) or available_cores()
+
 
 def print_render_status(message, is_error=False):
     timestamp = time.strftime("%H:%M:%S")
@@ -39,34 +95,6 @@ def print_render_status(message, is_error=False):
     print(f"[{timestamp}] {prefix} {message}")
 
 
-def download_file(url, filename):
-    """
-    Download a file from a URL
-    """
-    try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept": "video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5",
-            "Accept-Language": "en-US,en;q=0.5",
-            "Range": "bytes=0-",
-            "Connection": "keep-alive"
-        }
-
-        response = requests.get(url, headers=headers, stream=True)
-        response.raise_for_status()
-
-        with open(filename, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        return filename
-    except Exception as e:
-        print(f"Error downloading file: {str(e)}")
-        if os.path.exists(filename):
-            os.remove(filename)
-        return None
-
-
 def search_program(program_name):
     try:
         search_cmd = "where" if platform.system() == "Windows" else "which"
@@ -80,179 +108,296 @@ def get_program_path(program_name):
     return program_path
 
 
-def download_video(url_data, output_path):
-    print_render_status(f"Downloading video from {url_data}")
+def get_video_url(url_data):
+    """
+    Extract the URL from [start_time, end_time, url] or a bare URL
+    """
     if isinstance(url_data, list):
-        # Extract URL from [start_time, end_time, url] format
-        url = url_data[2]
-    else:
-        url = url_data
-
-    print_render_status(f"Downloading from URL: {url}")
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-
-    with open(output_path, 'wb') as file, tqdm(
-        desc="Downloading",
-        total=total_size,
-        unit='iB',
-        unit_scale=True,
-        unit_divisor=1024,
-    ) as pbar:
-        for data in response.iter_content(chunk_size=1024):
-            size = file.write(data)
-            pbar.update(size)
-    print_render_status("Video download completed")
-
-
-def get_output_media(audio_file, timed_captions, background_video_urls, video_server):
+        return url_data[2]
+    return url_data
+
+
+def get_clip_info(url_data):
+    """
+    Clip metadata attached by the video search as a fourth element, if any
+    """
+    if isinstance(url_data, list) and len(url_data) > 3 and isinstance(url_data[3], dict):
+        return url_data[3]
+    return {}
+
+
+def plan_clip_usage(background_video_urls):
+    """
+    Segments that share a clip read consecutive stretches of it. Returns the
+    start offset of each segment within its clip and the total seconds
+    needed from each URL.
+    """
+    offsets = []
+    needed = {}
+    for url_data in background_video_urls:
+        url = get_video_url(url_data)
+        offsets.append(needed.get(url, 0.0))
+        needed[url] = needed.get(url, 0.0) + float(url_data[1]) - float(url_data[0])
+    return offsets, needed
+
+
+def mux_subtitle_track(video_path, subtitle_path):
+    """
+    Mux an SRT file into the MP4 as a mov_text track without re-encoding
+    """
+    muxed_path = video_path + ".subs.mp4"
+    subprocess.run([
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-i", video_path, "-i", subtitle_path,
+        "-map", "0", "-map", "1",
+        "-c", "copy", "-c:s", "mov_text",
+        "-metadata:s:s:0", "language=eng",
+        "-movflags", "+faststart",
+        muxed_path
+    ], check=True)
+    os.replace(muxed_path, video_path)
+
+
+def get_output_media(audio_file, timed_captions, background_video_urls, video_server,
+                     caption_mode=None, render_engine=None, render_profile=None, theme=None,
+                     output_mode=None, hls_dir="output/hls"):
+    """
+    Render the final video. theme is an already analysed
+    (theme_type, background_music_path) pair; it is analysed here if omitted.
+    In "hls" output mode the playlist is written to hls_dir.
+    """
     print_render_status("Starting video rendering process")
+    caption_mode = caption_mode or CAPTION_MODE
+    if caption_mode not in CAPTION_MODES:
+        raise ValueError(f"Unknown caption mode: {caption_mode}")
+    render_engine = render_engine or RENDER_ENGINE
+    if render_engine not in RENDER_ENGINES:
+        raise ValueError(f"Unknown render engine: {render_engine}")
+    render_profile = render_profile or RENDER_PROFILE
+    if render_profile not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile: {render_profile}")
+    output_mode = output_mode or OUTPUT_MODE
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode: {output_mode}")
 
     # Create output directory if it doesn't exist
     if not os.path.exists("output"):
         os.makedirs("output")
 
     # Analyze theme and get appropriate background music
-    print_render_status("Analyzing content theme")
-    all_text = " ".join([text for _, text in timed_captions])
-    theme_type, background_music_path = analyze_theme(all_text)
+    if theme is None:
+        print_render_status("Analyzing content theme")
+        all_text = " ".join([text for _, text in timed_captions])
+        with span("theme"):
+            theme = analyze_theme(all_text)
+    theme_type, background_music_path = theme
     print_render_status(f"Selected theme: {theme_type}")
 
+    print_render_status(f"Render profile: {render_profile}")
+    with span("render", engine=render_engine, profile=render_profile, output_mode=output_mode):
+        output_path = render_video(audio_file, timed_captions, background_video_urls,
+                                   background_music_path, "output/rendered_video.mp4",
+                                   caption_mode, render_engine,
+                                   profile=RENDER_PROFILES[render_profile],
+                                   hls_dir=hls_dir if output_mode == "hls" else None)
+    if output_path is None:
+        return None
+
+    if caption_mode != "burn":
+        print_render_status("Writing subtitle files")
+        with span("render.subtitles", "render", caption_mode=caption_mode):
+            subtitle_paths = write_subtitles(timed_captions, output_path)
+            if caption_mode == "soft":
+                print_render_status("Muxing subtitle track")
+                mux_subtitle_track(output_path, subtitle_paths["srt"])
+
+    print_render_status("Video rendering completed successfully")
+    return output_path
+
+
+def render_video(audio_file, timed_captions, background_video_urls, background_music_path,
+                 output_path, caption_mode="burn", render_engine=None, fallback=True,
+                 profile=None, hls_dir=None):
+    """
+    Render with the selected engine and profile (a RENDER_PROFILES entry).
+    A failing ffmpeg or parallel render falls back to the moviepy compositor
+    unless fallback is False. With hls_dir an HLS playlist of the video is
+    written there as well.
+    """
+    render_engine = render_engine or RENDER_ENGINE
+    profile = profile or RENDER_PROFILES[RENDER_PROFILE]
+    # Holds this render's proxies when the clip cache is disabled
+    with tempfile.TemporaryDirectory(prefix="clips_") as work_dir:
+        if render_engine in ("ffmpeg", "parallel"):
+            try:
+                return render_with_ffmpeg(audio_file, timed_captions, background_video_urls,
+                                          background_music_path, output_path, caption_mode,
+                                          parallel=render_engine == "parallel", profile=profile,
+                                          hls_dir=hls_dir, work_dir=work_dir)
+            except Exception as e:
+                if not fallback:
+                    raise
+                print_render_status(
+                    f"{render_engine} engine failed, falling back to moviepy: {str(e)}",
+                    is_error=True)
+        return render_with_moviepy(audio_file, timed_captions, background_video_urls,
+                                   background_music_path, output_path, caption_mode, profile,
+                                   hls_dir, work_dir=work_dir)
+
+
+def submit_background_clips(background_video_urls, downloads, profile, work_dir=None):
+    """
+    Start every clip download up front and return the futures (resolving to
+    local paths) together with each segment's offset into its clip. A clip
+    used by several segments is fetched once, for the total duration they
+    need.
+    """
+    offsets, needed = plan_clip_usage(background_video_urls)
+    # Transcode each clip once into a cached proxy at the output size and fps
+    ingest = ((lambda path: make_proxy(path, profile['width'], profile['height'], profile['fps'],
+                                       work_dir))
+              if CLIP_PROXIES else None)
+    download_futures = [
+        downloads.submit_clip(get_video_url(url_data), f"output/background_{i}.mp4",
+                              postprocess=ingest,
+                              duration=needed[get_video_url(url_data)],
+                              clip_duration=get_clip_info(url_data).get('duration'))
+        for i, url_data in enumerate(background_video_urls)
+    ]
+    return download_futures, offsets
+
+
+def resolve_segments(background_video_urls, profile, work_dir=None):
+    """
+    Fetch the background clips and return the segments as (path, offset,
+    duration) in timeline order, with the duration of each clip file.
+    Segments whose clip failed to download are skipped.
+    """
+    segments = []
+    clip_durations = {}
+    with span("render.fetch_clips", "render", clips=len(background_video_urls)), \
+            DownloadManager() as downloads:
+        download_futures, offsets = submit_background_clips(background_video_urls, downloads,
+                                                            profile, work_dir)
+        for i, url_data in enumerate(background_video_urls):
+            try:
+                print_render_status(f"Processing video {i+1}/{len(background_video_urls)}")
+                video_path = download_futures[i].result()
+            except Exception as e:
+                print_render_status(
+                    f"Error processing video {i+1}: {str(e)}", is_error=True)
+                continue
+            if video_path not in clip_durations:
+                clip_durations[video_path] = ffmpeg_parse_infos(video_path)['duration']
+            desired_duration = float(url_data[1]) - float(url_data[0])
+            offset = offsets[i]
+            if offset + desired_duration > clip_durations[video_path]:
+                offset = 0
+            segments.append((video_path, offset, desired_duration))
+    return segments, clip_durations
+
+
+def render_with_ffmpeg(audio_file, timed_captions, background_video_urls, background_music_path,
+                       output_path, caption_mode="burn", parallel=False, profile=None,
+                       hls_dir=None, work_dir=None):
+    """
+    Compile the render into a single ffmpeg filtergraph (see ffmpeg_engine),
+    or with parallel into independently encoded parts (see segment_render)
+    """
+    profile = profile or RENDER_PROFILES[RENDER_PROFILE]
+    total_duration = timed_captions[-1][0][1]
+
+    print_render_status("Fetching background videos")
+    segments, _ = resolve_segments(background_video_urls, profile, work_dir)
+    if not segments:
+        print_render_status("No valid background clips found", is_error=True)
+        return None
+
+    if parallel:
+        print_render_status(f"Rendering {len(segments)} segments in parallel")
+        return render_segments_parallel(
+            segments, audio_file, background_music_path, timed_captions, total_duration,
+            output_path, profile['width'], profile['height'], profile['fps'],
+            voice_volume=VOICE_VOLUME, music_volume=BACKGROUND_MUSIC_VOLUME,
+            burn_captions=caption_mode == "burn", preset=profile['preset'], crf=profile['crf'],
+            audio_bitrate=profile['audio_bitrate'], hls_dir=hls_dir)
+
+    print_render_status("Rendering with ffmpeg (single pass)")
+    return render_ffmpeg(segments, audio_file, background_music_path, timed_captions,
+                         total_duration, output_path, profile['width'], profile['height'],
+                         profile['fps'], voice_volume=VOICE_VOLUME,
+                         music_volume=BACKGROUND_MUSIC_VOLUME,
+                         burn_captions=caption_mode == "burn", threads=RENDER_THREADS,
+                         preset=profile['preset'], crf=profile['crf'],
+                         audio_bitrate=profile['audio_bitrate'], hls_dir=hls_dir)
+
+
+def render_with_moviepy(audio_file, timed_captions, background_video_urls, background_music_path,
+                        output_path, caption_mode="burn", profile=None, hls_dir=None,
+                        work_dir=None):
+    profile = profile or RENDER_PROFILES[RENDER_PROFILE]
+    width, height = profile['width'], profile['height']
+
     # Get total duration from the last caption
     total_duration = timed_captions[-1][0][1]
 
-    # Download and process background videos
+    # Only the clip files are fetched here; frames are decoded on demand by
+    # the streaming timeline, so memory does not grow with the video length
     print_render_status("Processing background videos")
-    background_clips = []
-    for i, url_data in enumerate(background_video_urls):
-        try:
-            print_render_status(
-                f"Processing video {i+1}/{len(background_video_urls)}")
-            video_path = f"output/background_{i}.mp4"
-            download_video(url_data, video_path)
-
-            # Load video clip
-            print_render_status(f"Loading video {i+1}")
-            video_clip = VideoFileClip(video_path)
-
-            # Extract start and end times
-            start_time = float(url_data[0])
-            end_time = float(url_data[1])
-            desired_duration = end_time - start_time
-
-            # If video is shorter than desired duration, loop it
-            if video_clip.duration < desired_duration:
-                print_render_status(
-                    f"Video {i+1} is shorter than desired duration, looping it")
-                video_clip = video_clip.loop(duration=desired_duration)
-            else:
-                # Trim video to match the specified time range
-                print_render_status(f"Trimming video {i+1}")
-                video_clip = video_clip.subclip(0, desired_duration)
-
-            # Resize video to portrait dimensions
-            print_render_status(f"Resizing video {i+1}")
-            video_clip = video_clip.resize(newsize=(VIDEO_WIDTH, VIDEO_HEIGHT))
-
-            background_clips.append(video_clip)
-        except Exception as e:
-            print_render_status(
-                f"Error processing video {i+1}: {str(e)}", is_error=True)
-            continue
-
-    if not background_clips:
+    segments, clip_durations = resolve_segments(background_video_urls, profile, work_dir)
+    if not segments:
         print_render_status("No valid background clips found", is_error=True)
         return None
 
-    # Concatenate all background clips
-    print_render_status("Concatenating background videos")
-    final_background = concatenate_videoclips(background_clips)
-
-    # Ensure the background video covers the entire duration
-    if final_background.duration < total_duration:
-        print_render_status(
-            "Extending background video to cover full duration")
-        final_background = final_background.loop(duration=total_duration)
-    elif final_background.duration > total_duration:
-        print_render_status(
-            "Trimming background video to match total duration")
-        final_background = final_background.subclip(0, total_duration)
-
-    # Load and process audio
-    print_render_status("Processing audio")
-    voice_audio = AudioFileClip(audio_file)
-
-    # Load theme-appropriate background music
-    print_render_status(f"Loading {theme_type} background music")
-    background_music = AudioFileClip(background_music_path)
-
-    # Loop background music if needed
-    if background_music.duration < total_duration:
-        background_music = audio_loop(
-            background_music, duration=total_duration)
-    else:
-        background_music = background_music.subclip(0, total_duration)
-
-    # Adjust volumes
-    voice_audio = voice_audio.volumex(VOICE_VOLUME)
-    background_music = background_music.volumex(BACKGROUND_MUSIC_VOLUME)
-
-    # Combine audio tracks
-    print_render_status("Combining audio tracks")
-    final_audio = CompositeAudioClip([background_music, voice_audio])
-
-    # Create text clips for captions
-    print_render_status("Creating caption overlays")
-    caption_clips = []
-    for caption in timed_captions:
-        time_range, text = caption
-        start_time, end_time = time_range
-        text_clip = TextClip(
-            text,
-            fontsize=60,  # Slightly smaller font for portrait mode
-            color='white',
-            bg_color='black',
-            font='Arial',
-            size=(VIDEO_WIDTH - 100, None),  # Leave some margin on the sides
-            method='caption',
-            align='center'
-        )
-        # Position captions in the lower third of the screen
-        text_clip = text_clip.set_position(('center', VIDEO_HEIGHT - 300)).set_duration(
-            end_time - start_time).set_start(start_time)
-        caption_clips.append(text_clip)
-
-    # Combine all elements
-    print_render_status("Combining video elements")
-    final_video = CompositeVideoClip(
-        [final_background] + caption_clips,
-        size=(VIDEO_WIDTH, VIDEO_HEIGHT)
-    )
-
-    # Set audio
-    print_render_status("Setting audio track")
-    final_video = final_video.set_audio(final_audio)
-
-    # Write final video
-    print_render_status("Writing final video (this may take several minutes)")
-    output_path = "output/rendered_video.mp4"
-    final_video.write_videofile(
-        output_path,
-        fps=30,
-        codec='libx264',
-        audio_codec='aac',
-        threads=4,
-        preset='medium'
-    )
-
-    # Clean up
-    print_render_status("Cleaning up temporary files")
-    final_video.close()
-    voice_audio.close()
-    background_music.close()
-    final_audio.close()
-    for clip in background_clips:
-        clip.close()
+    # Mix the voice over the looped background music up front (NumPy, cached
+    # music bed); the encoded track is muxed as is by write_videofile
+    audio_track = output_path + ".audio.m4a"
+    timeline = None
+    try:
+        print_render_status("Mixing audio tracks")
+        with span("render.audio_mix", "render"):
+            mix_audio(audio_file, background_music_path, total_duration, audio_track,
+                      voice_volume=VOICE_VOLUME, music_volume=BACKGROUND_MUSIC_VOLUME,
+                      audio_bitrate=profile['audio_bitrate'])
+
+        if caption_mode == "burn":
+            # Captions are blended into each frame as it is produced
+            print_render_status("Captions will be drawn into the frames")
+        else:
+            # Captions are delivered as subtitle files, so no compositing is needed
+            print_render_status("Skipping caption overlays (caption mode: {})".format(caption_mode))
+        timeline = StreamingTimeline(segments, clip_durations, total_duration, width, height,
+                                     timed_captions if caption_mode == "burn" else None)
+        final_video = timeline.to_clip()
+
+        # Write final video
+        print_render_status("Writing final video (this may take several minutes)")
+        if hls_dir:
+            # Drop any playlist left by a failed ffmpeg render
+            reset_dir(hls_dir)
+        # Frame production (sampled as frame.* spans) and x264 share this span
+        with span("render.encode", "render", frames=round(total_duration * profile['fps'])):
+            final_video.write_videofile(
+                output_path,
+                fps=profile['fps'],
+                codec='libx264',
+                audio=audio_track,
+                threads=RENDER_THREADS,
+                preset=profile['preset'],
+                ffmpeg_params=["-crf", str(profile['crf']), "-movflags", "+faststart",
+                               *(keyframe_args() if hls_dir else [])]
+            )
+        final_video.close()
+        if hls_dir:
+            print_render_status("Writing HLS playlist")
+            with span("render.hls", "render"):
+                segment_video(output_path, hls_dir)
+    finally:
+        # Clean up, also after a failed render
+        print_render_status("Cleaning up temporary files")
+        if timeline is not None:
+            timeline.close()
+        if os.path.exists(audio_track):
+            os.remove(audio_track)
 
-    print_render_status("Video rendering completed successfully")
     return output_path
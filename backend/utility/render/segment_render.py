@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from moviepy.config import get_setting
+from utility.render.ffmpeg_engine import (audio_filtergraph, build_filtergraph, cover_timeline,
+                                          write_caption_files)
+from utility.render.hls_output import HlsPlaylist
+from utility.tracer import span, traced
+from utility.video import clip_cache
+from utility.video.clip_ingest import source_key
+
+# Segment-parallel rendering: the timeline is cut at background segment
+# boundaries, every part is encoded by its own ffmpeg process with identical
+# encoder settings, and the parts are joined with the concat demuxer without
+# re-encoding. The audio is mixed and muxed once at the end.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+# x264 threads per part encoder
+RENDER_PART_THREADS = int(os.getenv("RENDER_PART_THREADS", 2))
+# Encoded parts are kept in the clip cache under a key derived from
+# everything that affects their pixels, so unchanged parts are reused.
+# Parts stay in the render's work dir when the clip cache is disabled.
+RENDER_PART_CACHE = os.getenv("RENDER_PART_CACHE", "true").lower() in ("1", "true", "yes")
+# Shared time base, so stream-copied parts concatenate without drift
+PART_TIMESCALE = 90000
+
+
+def plan_parts(segments, timed_captions, total_duration, fps):
+    """
+    Cut the timeline into one part per background segment. Part boundaries
+    are snapped to the frame grid; each part carries the captions that
+    overlap it, shifted to part-local time.
+    """
+    parts = []
+    start = 0.0
+    for path, offset, duration in cover_timeline(segments, total_duration):
+        end = min(start + duration, total_duration)
+        first_frame, last_frame = round(start * fps), round(end * fps)
+        if last_frame > first_frame:
+            captions = [((max(s, start) - start, min(e, end) - start), text)
+                        for (s, e), text in timed_captions if s < end and e > start]
+            parts.append({'path': path,
+                          'offset': offset,
+                          'frames': last_frame - first_frame,
+                          'captions': captions})
+        start = end
+        if start >= total_duration:
+            break
+    return parts
+
+
+def encoder_args(preset, crf, threads):
+    return ["-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+            "-video_track_timescale", str(PART_TIMESCALE), "-threads", str(threads)]
+
+
+def part_key(part, width, height, fps, preset, crf, burn_captions):
+    """
+    Content address of an encoded part
+    """
+    description = {
+        'source': source_key(part['path']),
+        'offset': round(part['offset'], 3),
+        'frames': part['frames'],
+        'captions': [[round(s, 3), round(e, 3), text] for (s, e), text in part['captions']]
+                    if burn_captions else [],
+        'size': [width, height],
+        'fps': fps,
+        'encoder': encoder_args(preset, crf, 0)[:-2]
+    }
+    digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8"))
+    return "part-" + digest.hexdigest()[:40]
+
+
+def encode_part(part, output_path, width, height, fps, preset, crf, threads, burn_captions):
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    duration = part['frames'] / fps
+    with tempfile.TemporaryDirectory(prefix="render_part_") as work_dir:
+        caption_files = write_caption_files(work_dir, part['captions']) if burn_captions else []
+        script_path = os.path.join(work_dir, "filtergraph.txt")
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(build_filtergraph([part], part['captions'], caption_files, width, height, fps))
+        try:
+            subprocess.run([
+                get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                # Looping the input covers clips shorter than their segment
+                "-stream_loop", "-1", "-ss", f"{part['offset']:.3f}",
+                "-t", f"{duration + 1.0 / fps:.3f}", "-i", part['path'],
+                "-filter_complex_script", script_path,
+                "-map", "[vout]", "-an",
+                "-frames:v", str(part['frames']), "-r", str(fps),
+                *encoder_args(preset, crf, threads),
+                "-f", "mp4", tmp_path
+            ], check=True)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return output_path
+
+
+def render_part(part, work_dir, index, width, height, fps, preset, crf, threads, burn_captions):
+    with span("render.part", "render", index=index, frames=part['frames']):
+        return _render_part(part, work_dir, index, width, height, fps, preset, crf, threads,
+                            burn_captions)
+
+
+def _render_part(part, work_dir, index, width, height, fps, preset, crf, threads, burn_captions):
+    if RENDER_PART_CACHE and clip_cache.CLIP_CACHE:
+        return clip_cache.get_or_create(
+            part_key(part, width, height, fps, preset, crf, burn_captions),
+            lambda path: encode_part(part, path, width, height, fps, preset, crf, threads,
+                                     burn_captions),
+            kind="parts")
+    return encode_part(part, os.path.join(work_dir, f"part_{index}.mp4"),
+                       width, height, fps, preset, crf, threads, burn_captions)
+
+
+def concat_parts(part_paths, audio_file, background_music_path, total_duration, output_path,
+                 voice_volume, music_volume, work_dir, audio_bitrate=None):
+    list_path = os.path.join(work_dir, "parts.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in part_paths:
+            escaped = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    subprocess.run([
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-i", audio_file,
+        "-stream_loop", "-1", "-i", background_music_path,
+        "-filter_complex", audio_filtergraph(1, 2, voice_volume, music_volume).replace("\n", ""),
+        "-map", "0:v", "-map", "[aout]",
+        "-c:v", "copy", "-c:a", "aac", *(["-b:a", audio_bitrate] if audio_bitrate else []),
+        "-t", f"{total_duration:.3f}",
+        "-movflags", "+faststart",
+        output_path
+    ], check=True)
+    return output_path
+
+
+def mix_audio_track(audio_file, background_music_path, total_duration, output_path,
+                    voice_volume, music_volume):
+    """
+    Voice and looped music mixed to PCM, for slicing into HLS segments
+    """
+    subprocess.run([
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-i", audio_file,
+        "-stream_loop", "-1", "-i", background_music_path,
+        "-filter_complex", audio_filtergraph(0, 1, voice_volume, music_volume).replace("\n", ""),
+        "-map", "[aout]", "-c:a", "pcm_s16le",
+        "-t", f"{total_duration:.3f}",
+        output_path
+    ], check=True)
+    return output_path
+
+
+def mux_segment(part_path, audio_path, start, duration, segment_path, audio_bitrate=None):
+    """
+    Wrap an encoded part and its stretch of the audio into an MPEG-TS
+    segment placed at start on the timeline
+    """
+    tmp_path = segment_path + ".tmp"
+    try:
+        subprocess.run([
+            get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-i", part_path,
+            "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", audio_path,
+            "-map", "0:v", "-map", "1:a",
+            "-c:v", "copy", "-c:a", "aac", *(["-b:a", audio_bitrate] if audio_bitrate else []),
+            "-output_ts_offset", f"{start:.3f}",
+            "-f", "mpegts", tmp_path
+        ], check=True)
+        os.replace(tmp_path, segment_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return segment_path
+
+
+def publish_parts(futures, parts, audio_file, background_music_path, total_duration, fps,
+                  voice_volume, music_volume, audio_bitrate, work_dir, hls_dir):
+    """
+    Add each part to the HLS playlist as soon as it and every part before
+    it are encoded. Returns the part paths in timeline order.
+    """
+    playlist = HlsPlaylist(hls_dir, max(part['frames'] for part in parts) / fps)
+    with span("render.audio_mix", "render"):
+        audio_path = mix_audio_track(audio_file, background_music_path, total_duration,
+                                     os.path.join(work_dir, "audio.wav"), voice_volume,
+                                     music_volume)
+    part_paths = []
+    start = 0.0
+    for index, (future, part) in enumerate(zip(futures, parts)):
+        part_path = future.result()
+        duration = part['frames'] / fps
+        with span("render.hls_segment", "render", index=index):
+            segment_path = mux_segment(part_path, audio_path, start, duration,
+                                       playlist.segment_path(index), audio_bitrate)
+        playlist.add(segment_path, duration)
+        part_paths.append(part_path)
+        start += duration
+    playlist.finish()
+    return part_paths
+
+
+def render_segments_parallel(segments, audio_file, background_music_path, timed_captions,
+                             total_duration, output_path, width, height, fps, voice_volume=1.0,
+                             music_volume=0.05, burn_captions=True, preset="medium", crf=23,
+                             audio_bitrate=None, workers=None, threads=None, hls_dir=None):
+    """
+    Render the video as independently encoded parts joined by stream copy.
+
+    segments is a list of (path, offset, duration) in timeline order. With
+    hls_dir every part is also published there as an HLS segment once it is
+    ready.
+    """
+    if not segments:
+        raise ValueError("No background segments to render")
+    parts = plan_parts(segments, timed_captions, total_duration, fps)
+    threads = threads or RENDER_PART_THREADS
+
+    with tempfile.TemporaryDirectory(prefix="render_") as work_dir:
+        # Each part is encoded by a separate ffmpeg process; the threads only
+        # wait on them
+        with ThreadPoolExecutor(max_workers=workers or RENDER_WORKERS) as pool:
+            futures = [pool.submit(traced(render_part), part, work_dir, i, width, height, fps,
+                                   preset, crf, threads, burn_captions)
+                       for i, part in enumerate(parts)]
+            if hls_dir:
+                part_paths = publish_parts(futures, parts, audio_file, background_music_path,
+                                           total_duration, fps, voice_volume, music_volume,
+                                           audio_bitrate, work_dir, hls_dir)
+            else:
+                part_paths = [future.result() for future in futures]
+        with span("render.concat", "render", parts=len(part_paths)):
+            return concat_parts(part_paths, audio_file, background_music_path, total_duration,
+                                output_path, voice_volume, music_volume, work_dir, audio_bitrate)
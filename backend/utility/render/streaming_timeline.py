@@ -0,0 +1,159 @@
+import os
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+import numpy as np
+from moviepy.editor import VideoClip
+from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader
+from utility.render.caption_renderer import caption_layout, render_caption
+from utility.render.ffmpeg_engine import cover_timeline
+from utility.tracer import TRACE_FRAME_SAMPLE, current_tracer
+from utility.video import clip_cache
+
+# Streaming timeline for the moviepy engine. Instead of opening a reader per
+# background segment and a clip per caption up front, frames are produced on
+# demand: a source is opened when its segment starts, closed once no later
+# segment uses it, and the caption visible at t is blended into the frame.
+# Memory stays flat however long the video is.
+RENDER_MAX_READERS = int(os.getenv("RENDER_MAX_READERS", 2))
+# Sources are opened late, so the cached clips that later segments read are
+# touched this often to keep other jobs' cache eviction away from them
+PIN_INTERVAL_SECONDS = clip_cache.CLIP_CACHE_MIN_AGE_SECONDS / 4
+
+
+class ReaderPool:
+    """
+    Open frame readers, least recently used first; at most max_open (each
+    reader is an ffmpeg process plus its frame buffer)
+    """
+
+    def __init__(self, width, height, max_open=None):
+        self.size = (height, width)
+        self.max_open = max(1, max_open or RENDER_MAX_READERS)
+        self.readers = OrderedDict()
+        self.opened = 0
+
+    def get(self, path):
+        if path in self.readers:
+            self.readers.move_to_end(path)
+            return self.readers[path]
+        while len(self.readers) >= self.max_open:
+            _, reader = self.readers.popitem(last=False)
+            reader.close()
+        # ffmpeg scales to the output size, so no resize in Python
+        reader = FFMPEG_VideoReader(path, target_resolution=self.size)
+        self.readers[path] = reader
+        self.opened += 1
+        return reader
+
+    def release(self, path):
+        reader = self.readers.pop(path, None)
+        if reader is not None:
+            reader.close()
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers.clear()
+
+
+class StreamingTimeline:
+    """
+    Background segments (path, offset, duration) and timed captions as one
+    lazily evaluated frame source. clip_durations maps each path to its
+    length; segments longer than their clip loop it.
+    """
+
+    def __init__(self, segments, clip_durations, total_duration, width, height,
+                 timed_captions=None, max_readers=None):
+        self.segments = cover_timeline(segments, total_duration)
+        self.clip_durations = clip_durations
+        self.total_duration = total_duration
+        self.width, self.height = width, height
+        self.starts = []
+        start = 0.0
+        for _, _, duration in self.segments:
+            self.starts.append(start)
+            start += duration
+        # Index of the last segment that reads each file
+        self.last_use = {path: i for i, (path, _, _) in enumerate(self.segments)}
+        self.current = -1
+        self.pool = ReaderPool(width, height, max_readers)
+        self.pin()
+
+        self.captions = sorted(timed_captions or [], key=lambda caption: caption[0][0])
+        self.caption_starts = [start for (start, _), _ in self.captions]
+        self.fontsize, self.caption_width, self.caption_top = caption_layout(width, height)
+
+        # Sampled frame timings go to the tracer of the rendering thread
+        self.tracer = current_tracer()
+        self.frames = 0
+
+    def pin(self):
+        """Touch the cached clips of the current and later segments"""
+        clip_cache.touch(path for path, last in self.last_use.items() if last >= self.current)
+        self.pinned_at = time.monotonic()
+
+    def source_time(self, index, t):
+        path, offset, _ = self.segments[index]
+        clip_duration = self.clip_durations[path]
+        # Stay clear of the last frame, which readers often cannot decode
+        return (offset + t - self.starts[index]) % max(clip_duration - 0.05, 0.05)
+
+    def background_frame(self, t):
+        index = max(0, bisect_right(self.starts, t) - 1)
+        if index != self.current:
+            # Sources whose last segment has passed are closed right away
+            for path, last in self.last_use.items():
+                if self.current <= last < index:
+                    self.pool.release(path)
+            self.current = index
+        if time.monotonic() - self.pinned_at > PIN_INTERVAL_SECONDS:
+            self.pin()
+        reader = self.pool.get(self.segments[index][0])
+        return reader.get_frame(self.source_time(index, t))
+
+    def active_caption(self, t):
+        index = bisect_right(self.caption_starts, t) - 1
+        if index >= 0:
+            (start, end), text = self.captions[index]
+            if start <= t < end:
+                return text
+        return None
+
+    def overlay_caption(self, frame, text):
+        rgba = render_caption(text, self.caption_width, fontsize=self.fontsize,
+                              color='white', bg_color='black', align='center')
+        x = (self.width - rgba.shape[1]) // 2
+        y = self.caption_top
+        height = min(rgba.shape[0], self.height - y)
+        if height <= 0:
+            return frame
+        frame = np.array(frame)
+        region = frame[y:y + height, x:x + rgba.shape[1]]
+        alpha = rgba[:height, :, 3:4] / 255.0
+        region[:] = rgba[:height, :, :3] * alpha + region * (1 - alpha)
+        return frame
+
+    def make_frame(self, t):
+        self.frames += 1
+        # Every TRACE_FRAME_SAMPLE-th frame is timed when the job is traced
+        tracer = self.tracer if self.frames % TRACE_FRAME_SAMPLE == 0 else None
+        start = time.perf_counter() if tracer is not None else None
+        frame = self.background_frame(t)
+        if tracer is not None:
+            decoded = time.perf_counter()
+            tracer.record("frame.decode", "frame", start, decoded, {'t': round(t, 3)})
+        text = self.active_caption(t)
+        if text is not None:
+            frame = self.overlay_caption(frame, text)
+            if tracer is not None:
+                tracer.record("frame.captions", "frame", decoded, time.perf_counter(),
+                              {'t': round(t, 3)})
+        return frame
+
+    def to_clip(self):
+        return VideoClip(self.make_frame, duration=self.total_duration)
+
+    def close(self):
+        self.pool.close()
@@ -1,8 +1,8 @@
 import os
-from openai import OpenAI
 import json
 import re
 from dotenv import load_dotenv
+from utility.llm.gateway import chat, PROVIDER_GROQ, PROVIDER_OPENAI
 
 # Load environment variables
 load_dotenv()
@@ -13,18 +13,15 @@ print("OPENAI_API_KEY:", os.getenv('OPENAI_API_KEY'))
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if GROQ_API_KEY and len(GROQ_API_KEY) > 30:
-    from groq import Groq
     model = "mixtral-8x7b-32768"
-    client = Groq(
-        api_key=GROQ_API_KEY,
-    )
+    provider = PROVIDER_GROQ
 else:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY not found in environment variables")
     print("Debug - Using OpenAI with key:", OPENAI_API_KEY[:10] + "...")
     model = "gpt-4"
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    provider = PROVIDER_OPENAI
 
 
 def generate_script(topic):
@@ -54,14 +51,16 @@ def generate_script(topic):
         """
     )
 
-    response = client.chat.completions.create(
+    # Not cached: asking again for a topic should give a new script
+    content = chat(
         model=model,
+        provider=provider,
+        cache=False,
         messages=[
             {"role": "system", "content": prompt},
             {"role": "user", "content": topic}
         ]
     )
-    content = response.choices[0].message.content
     try:
         # First try to parse as is
         script = json.loads(content)["script"]
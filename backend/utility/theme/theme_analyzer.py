@@ -1,26 +1,106 @@
+import hashlib
 import os
-from openai import OpenAI
-from typing import Literal, Tuple
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Literal, Optional, Tuple
+from utility.llm.gateway import chat
 
 ThemeType = Literal["comedy", "exciting", "relaxing", "sad", "thriller"]
 
+# Map theme to music file
+THEME_TO_MUSIC = {
+    "comedy": "utility/comedy.mp3",
+    "exciting": "utility/exciting.mp3",
+    "relaxing": "utility/relaxing.mp3",
+    "sad": "utility/sad.mp3",
+    "thriller": "utility/thriller.mp3"
+}
+DEFAULT_THEME = "relaxing"
 
-def analyze_theme(text: str) -> Tuple[ThemeType, str]:
+# Theme sources:
+#   "llm"    - ask the LLM; the local classifier is used if the call fails
+#   "hybrid" - local classifier first, LLM only when it is not confident
+#   "local"  - keyword classifier only, no LLM call
+THEME_MODES = ("llm", "hybrid", "local")
+THEME_MODE = os.getenv("THEME_MODE", "llm")
+# Results are cached in memory by a hash of the mode and text
+THEME_CACHE_SIZE = int(os.getenv("THEME_CACHE_SIZE", 512))
+
+# Words that point to a theme. Matched as whole words, also with common
+# inflections (see word_forms), so "rest" does not match "restaurant".
+THEME_LEXICON = {
+    "comedy": ("funny", "laugh", "laughter", "joke", "hilarious", "silly", "prank", "comic",
+               "comedy", "giggle", "ridiculous", "awkward", "goofy", "clumsy", "amuse",
+               "amusing", "humor", "humour", "banana"),
+    "exciting": ("adventure", "adventurous", "race", "speed", "fast", "victory", "win",
+                 "winning", "winner", "champion", "championship", "explore", "exploration",
+                 "discover", "discovery", "battle", "hero", "heroic", "rocket", "launch",
+                 "extreme", "thrill", "amazing", "incredible", "record", "epic"),
+    "relaxing": ("calm", "peace", "peaceful", "relax", "relaxation", "gentle", "quiet", "breeze",
+                 "meditate", "meditation", "sleep", "nature", "ocean", "garden", "forest",
+                 "sunset", "slow", "soft", "rest", "tranquil", "serene", "cozy"),
+    "sad": ("sad", "sadness", "grief", "grieve", "loss", "lost", "died", "death", "dying",
+            "tears", "cry", "lonely", "alone", "sorrow", "heartbreak", "heartbroken", "funeral",
+            "goodbye", "regret", "miss", "tragic", "tragedy", "mourn"),
+    "thriller": ("murder", "murderer", "killer", "kill", "dark", "darkness", "shadow", "scream",
+                 "blood", "bloody", "mystery", "mysterious", "terror", "terrifying", "horror",
+                 "haunt", "ghost", "creep", "creepy", "danger", "dangerous", "chase", "suspect",
+                 "crime", "secret", "fear", "afraid", "whisper", "night"),
+}
+# Minimum keyword hits, and lead over the runner-up, for a confident answer
+LOCAL_MIN_HITS = 2
+LOCAL_MIN_MARGIN = 1
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def word_forms(word):
+    """The word plus its plural, past, -ing, -er, -ful and -ly forms"""
+    forms = {word + suffix for suffix in ("", "s", "es", "ed", "ing", "er", "ers", "ful", "ly")}
+    if word.endswith("e"):
+        forms |= {word + "d", word[:-1] + "ing"}
+    if word.endswith("y"):
+        forms |= {word[:-1] + "ies", word[:-1] + "ied"}
+    return forms
+
+
+# Every accepted form of a lexicon word, mapped to its theme
+_lexicon_forms = {form: theme
+                  for theme, words in THEME_LEXICON.items()
+                  for word in words
+                  for form in word_forms(word)}
+
+
+def classify_theme_local(text: str) -> Tuple[Optional[ThemeType], bool]:
     """
-    Analyze the text content to determine the appropriate theme and background music.
-    Returns a tuple of (theme_type, music_file_path)
+    Keyword classifier. Returns (theme or None, is_confident).
     """
-    client = OpenAI()
+    words = re.findall(r"[a-z']+", text.lower())
+    scores = Counter()
+    for word in words:
+        theme = _lexicon_forms.get(word)
+        if theme is not None:
+            scores[theme] += 1
+    if not scores:
+        return None, False
+    ranked = scores.most_common(2)
+    theme, hits = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return theme, hits >= LOCAL_MIN_HITS and hits - runner_up >= LOCAL_MIN_MARGIN
+
 
-    prompt = f"""Analyze the following text and determine its emotional theme. 
+def classify_theme_llm(text: str) -> str:
+    prompt = f"""Analyze the following text and determine its emotional theme.
     Choose one of these themes: comedy, exciting, relaxing, sad, thriller.
     Consider the overall tone, emotional content, and purpose of the text.
-    
+
     Text: {text}
-    
+
     Respond with just the theme name, nothing else."""
 
-    response = client.chat.completions.create(
+    theme = chat(
         model="gpt-3.5-turbo",
         messages=[
             {"role": "system", "content": "You are a theme analyzer that categorizes content into specific emotional themes."},
@@ -29,19 +109,49 @@ def analyze_theme(text: str) -> Tuple[ThemeType, str]:
         temperature=0.3  # Lower temperature for more consistent categorization
     )
 
-    theme = response.choices[0].message.content.strip().lower()
+    return theme.strip().lower()
+
+
+def select_theme(text: str, mode: str) -> Tuple[str, bool]:
+    """
+    Returns (theme, is_fallback); is_fallback is set when the LLM call
+    failed and the local classifier answered instead.
+    """
+    if mode in ("local", "hybrid"):
+        theme, confident = classify_theme_local(text)
+        if mode == "local" or confident:
+            return theme or DEFAULT_THEME, False
+    try:
+        return classify_theme_llm(text), False
+    except Exception as e:
+        print(f"Theme analysis failed, using the local classifier: {str(e)}")
+        return classify_theme_local(text)[0] or DEFAULT_THEME, True
+
+
+def analyze_theme(text: str, mode: Optional[str] = None) -> Tuple[ThemeType, str]:
+    """
+    Analyze the text content to determine the appropriate theme and background music.
+    Returns a tuple of (theme_type, music_file_path)
+    """
+    mode = mode or THEME_MODE
+    key = hashlib.sha256(f"{mode}\n{text}".encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
 
-    # Map theme to music file
-    theme_to_music = {
-        "comedy": "utility/comedy.mp3",
-        "exciting": "utility/exciting.mp3",
-        "relaxing": "utility/relaxing.mp3",
-        "sad": "utility/sad.mp3",
-        "thriller": "utility/thriller.mp3"
-    }
+    theme, is_fallback = select_theme(text, mode)
 
     # Default to relaxing if theme is not recognized
-    theme_type = theme if theme in theme_to_music else "relaxing"
-    music_path = theme_to_music[theme_type]
+    theme_type = theme if theme in THEME_TO_MUSIC else DEFAULT_THEME
+    result = (theme_type, THEME_TO_MUSIC[theme_type])
 
-    return theme_type, music_path
+    # A fallback after a transient LLM failure is not cached, so the next
+    # call for the same text asks the LLM again
+    if is_fallback:
+        return result
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > THEME_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Opt-in profiling. A job that is traced records a span for each pipeline
+# and render stage, plus timings for a sample of frames, and exports them as
+# Chrome trace JSON (chrome://tracing or https://ui.perfetto.dev). Without
+# an active tracer span() costs a thread-local lookup.
+RENDER_TRACE = os.getenv("RENDER_TRACE", "false").lower() in ("1", "true", "yes")
+# Every n-th frame of the moviepy compositor is timed
+TRACE_FRAME_SAMPLE = int(os.getenv("TRACE_FRAME_SAMPLE", 30))
+# Events kept per trace; later ones are counted but dropped
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", 100000))
+
+_local = threading.local()
+
+
+class Tracer:
+    """
+    Collects complete ("X") events for one job from any thread
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.origin = time.perf_counter()
+        self.created_at = time.time()
+        self.events = []
+        self.threads = {}
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def record(self, name, category, start, end, args=None):
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': 1,
+            'tid': thread.ident
+        }
+        if args:
+            event['args'] = args
+        with self.lock:
+            if len(self.events) >= TRACE_MAX_EVENTS:
+                self.dropped += 1
+                return
+            self.threads.setdefault(thread.ident, thread.name)
+            self.events.append(event)
+
+    def activate(self):
+        """Make this the tracer of the calling thread"""
+        _local.tracer = self
+
+    def bind(self, func):
+        """Wrap func so that it records into this tracer in whatever thread runs it"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(_local, 'tracer', None)
+            _local.tracer = self
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _local.tracer = previous
+        return wrapper
+
+    def to_chrome_trace(self):
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+            dropped = self.dropped
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': 1,
+                     'args': {'name': f"job {self.name}"}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                      'args': {'name': thread_name}}
+                     for tid, thread_name in threads.items()]
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'job': self.name,
+                          'created_at': self.created_at,
+                          'frame_sample': TRACE_FRAME_SAMPLE,
+                          'dropped_events': dropped}
+        }
+
+
+def current_tracer():
+    return getattr(_local, 'tracer', None)
+
+
+def deactivate():
+    _local.tracer = None
+
+
+def traced(func):
+    """func bound to the calling thread's tracer, for handing to a worker thread"""
+    tracer = current_tracer()
+    return tracer.bind(func) if tracer is not None else func
+
+
+@contextmanager
+def span(name, category="pipeline", **args):
+    """Record the enclosed block as a span if the thread is being traced"""
+    tracer = current_tracer()
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, category, start, time.perf_counter(), args)
@@ -1,34 +1,82 @@
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from utility.utils import log_response, LOG_TYPE_PEXEL
+from utility.http_client import get_session, DEFAULT_TIMEOUT
+from utility.video.pexels_cache import cached_search, normalize_query, record_quota
 from openai import OpenAI
 
 PEXELS_API_KEY = os.environ.get('PEXELS_KEY')
+PEXELS_SEARCH_URL = "https://api.pexels.com/videos/search"
+# Maximum number of Pexels lookups in flight per job
+PEXELS_CONCURRENCY = int(os.getenv("PEXELS_CONCURRENCY", 8))
 
+# Smallest acceptable video file: clips are cropped to cover the output
+# frame, so both dimensions must reach the output size
+CLIP_TARGET_WIDTH = int(os.getenv("CLIP_TARGET_WIDTH", 1080))
+CLIP_TARGET_HEIGHT = int(os.getenv("CLIP_TARGET_HEIGHT", 1920))
+CLIP_TARGET_FPS = float(os.getenv("CLIP_TARGET_FPS", 30))
 
-def search_videos(query_string, orientation_landscape=True):
-    url = "https://api.pexels.com/videos/search"
+# Results fetched per Pexels search; the extra results are alternatives
+# for segments whose first match is already used elsewhere in the video
+PEXELS_RESULTS_PER_PAGE = int(os.getenv("PEXELS_RESULTS_PER_PAGE", 15))
+# Prefer a not-yet-used clip from the same result page over repeating one
+CLIP_PREFER_UNUSED = os.getenv("CLIP_PREFER_UNUSED", "true").lower() in ("1", "true", "yes")
+
+# "pexel" (Pexels API) or "local" (indexed library, see local_library.py)
+VIDEO_SERVERS = ("pexel", "local")
+VIDEO_SERVER = os.getenv("VIDEO_SERVER", "pexel")
+
+
+def fetch_pexels_search(query, orientation, size, per_page):
+    """
+    Perform a Pexels video search request. Returns the JSON payload, or None
+    if the request failed.
+    """
     headers = {
-        "Authorization": PEXELS_API_KEY,
+        "Authorization": os.getenv('PEXELS_API_KEY') or PEXELS_API_KEY,
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
     }
-
-    # Remove the animation terms enhancement
     params = {
-        "query": query_string,  # Use original query directly
-        "orientation": "landscape" if orientation_landscape else "portrait",
-        "per_page": 15,
-        "size": "large"
+        "query": query,
+        "orientation": orientation,
+        "per_page": per_page,
+        "size": size
     }
 
-    response = requests.get(url, headers=headers, params=params)
-    json_data = response.json()
-    log_response(LOG_TYPE_PEXEL, query_string, response.json())
+    response = get_session().get(PEXELS_SEARCH_URL, headers=headers, params=params,
+                                 timeout=DEFAULT_TIMEOUT)
+    record_quota(response.headers)
+    if response.status_code != 200:
+        print(f"Pexels API error: {response.status_code} - {response.text}")
+        return None
 
+    json_data = response.json()
+    log_response(LOG_TYPE_PEXEL, query, json_data)
     return json_data
 
 
-def getBestVideo(query_string, orientation_landscape=True, used_vids=[]):
+def pexels_search(query, orientation="portrait", size="large", per_page=15):
+    """
+    Search Pexels videos through the persistent search cache
+    """
+    query = normalize_query(query)
+    return cached_search(query, orientation, size, per_page,
+                         lambda: fetch_pexels_search(query, orientation, size, per_page))
+
+
+def search_videos(query_string, orientation_landscape=True):
+    # Remove the animation terms enhancement
+    json_data = pexels_search(
+        query_string,  # Use original query directly
+        orientation="landscape" if orientation_landscape else "portrait",
+        size="large",
+        per_page=15)
+
+    return json_data or {'videos': []}
+
+
+def getBestVideo(query_string, orientation_landscape=True, used_vids=None):
+    used_vids = used_vids or []
     vids = search_videos(query_string, orientation_landscape)
     videos = vids['videos']  # Extract the videos list from JSON
 
@@ -65,74 +113,153 @@ def generate_video_url(timed_video_searches, server):
     """
     if server == "pexel":
         return generate_video_url_pexel(timed_video_searches)
+    elif server == "local":
+        return generate_video_url_local(timed_video_searches)
     else:
         return None
 
 
-def generate_video_url_pexel(timed_video_searches):
+def generate_video_url_pexel(timed_video_searches, prefer_unused=None):
     """
-    Generate video URLs using Pexels API
+    Generate video URLs using Pexels API. Clips are de-duplicated by Pexels
+    video id within the video: a segment whose best match is already used
+    takes the next unused result from the same page, and only reuses a clip
+    when every result is taken.
     """
     if not timed_video_searches:
         return None
+    prefer_unused = CLIP_PREFER_UNUSED if prefer_unused is None else prefer_unused
 
-    result = []
-    for start_time, end_time, search_terms in timed_video_searches:
-        if not search_terms:
-            continue
+    segments = [segment for segment in timed_video_searches if segment[2]]
 
+    def lookup(segment):
+        search_terms = segment[2]
         # Use the first search term for video search
         search_term = search_terms[0] if isinstance(
             search_terms, list) else search_terms
 
-        # Get video URL from Pexels
-        video_url = search_pexels_video(search_term)
-        if video_url:
-            result.append([start_time, end_time, video_url])
+        # Get candidate video files from Pexels
+        return search_pexels_clips(search_term)
+
+    # Look up all segments concurrently; map() keeps the segment order
+    with ThreadPoolExecutor(max_workers=PEXELS_CONCURRENCY) as pool:
+        candidates = list(pool.map(lookup, segments))
+
+    result = []
+    used_ids = set()
+    for (start_time, end_time, _), clips in zip(segments, candidates):
+        if not clips:
+            continue
+        clip = clips[0]
+        if prefer_unused:
+            clip = next((c for c in clips if c['video_id'] not in used_ids), clip)
+        used_ids.add(clip['video_id'])
+        # The fourth element carries the clip metadata used by the
+        # downloader (duration-limited fetches, variant info)
+        result.append([start_time, end_time, clip['url'], clip])
 
     return result if result else None
 
 
-def search_pexels_video(query):
+def generate_video_url_local(timed_video_searches):
     """
-    Search for a video on Pexels
+    Generate video paths from the local stock library index. Every search
+    term of a segment is tried in order, and (with CLIP_PREFER_UNUSED) clips
+    already used earlier in the video are skipped while an alternative exists.
     """
-    try:
-        headers = {
-            'Authorization': os.getenv('PEXELS_API_KEY')
-        }
+    from utility.video.local_library import search_local_clip
+
+    if not timed_video_searches:
+        return None
+
+    result = []
+    used_ids = set()
+    for start_time, end_time, search_terms in timed_video_searches:
+        if not search_terms:
+            continue
+        if not isinstance(search_terms, list):
+            search_terms = [search_terms]
+        clip = None
+        for exclude in ((used_ids, ()) if CLIP_PREFER_UNUSED else ((),)):
+            for search_term in search_terms:
+                clip = search_local_clip(search_term, min_duration=end_time - start_time,
+                                         exclude_ids=exclude)
+                if clip:
+                    break
+            if clip:
+                break
+        if clip:
+            used_ids.add(clip['video_id'])
+            result.append([start_time, end_time, clip['url'], clip])
+
+    return result if result else None
+
+
+def select_video_file(video_files, min_width=CLIP_TARGET_WIDTH, min_height=CLIP_TARGET_HEIGHT,
+                      min_fps=CLIP_TARGET_FPS):
+    """
+    Pick the smallest video file that still meets the target resolution and
+    frame rate, or the largest one if none does
+    """
+    def pixels(f):
+        return (f.get('width') or 0) * (f.get('height') or 0)
+
+    def meets_target(f):
+        fps = f.get('fps')
+        return ((f.get('width') or 0) >= min_width and (f.get('height') or 0) >= min_height
+                # Pexels reports e.g. 29.97 for 30 fps footage
+                and (fps is None or fps >= min_fps - 1))
+
+    files = [f for f in video_files if f.get('link') and f.get('file_type', 'video/mp4') == 'video/mp4']
+    if not files:
+        return None
+    suitable = [f for f in files if meets_target(f)]
+    if suitable:
+        return min(suitable, key=lambda f: (pixels(f), f.get('fps') or 0, f.get('size') or 0))
+    return max(files, key=lambda f: (pixels(f), f.get('fps') or 0))
 
+
+def search_pexels_clips(query, per_page=None):
+    """
+    Search for videos on Pexels and return the best file of each result,
+    with metadata, in result order
+    """
+    clips = []
+    try:
         # Remove the animation terms enhancement
-        params = {
-            'query': query,  # Use original query directly
-            'per_page': 1,
-            'orientation': 'portrait',
-            'size': 'large'
-        }
-
-        response = requests.get(
-            'https://api.pexels.com/videos/search',
-            headers=headers,
-            params=params
-        )
-
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('videos'):
-                video = data['videos'][0]
-                video_files = video['video_files']
-                # Get HD video file with height >= 1920
-                hd_video = next(
-                    (v for v in video_files if v['quality'] == 'hd' and v.get(
-                        'height', 0) >= 1920),
-                    # Fallback to first video file if no HD version found
-                    video_files[0]
-                )
-                return hd_video['link']
-        else:
-            print(
-                f"Pexels API error: {response.status_code} - {response.text}")
+        data = pexels_search(query, orientation='portrait', size='large',
+                             per_page=per_page or PEXELS_RESULTS_PER_PAGE)
+
+        for video in (data or {}).get('videos', []):
+            video_file = select_video_file(video['video_files'])
+            if video_file:
+                clips.append({
+                    'url': video_file['link'],
+                    'video_id': video.get('id'),
+                    'file_id': video_file.get('id'),
+                    'duration': video.get('duration'),
+                    'width': video_file.get('width'),
+                    'height': video_file.get('height'),
+                    'fps': video_file.get('fps'),
+                    'file_size': video_file.get('size')
+                })
     except Exception as e:
         print(f"Error searching Pexels: {str(e)}")
 
-    return None
+    return clips
+
+
+def search_pexels_clip(query):
+    """
+    Search for a video on Pexels and return its best file with metadata
+    """
+    clips = search_pexels_clips(query)
+    return clips[0] if clips else None
+
+
+def search_pexels_video(query):
+    """
+    Search for a video on Pexels
+    """
+    clip = search_pexels_clip(query)
+    return clip['url'] if clip else None
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from filelock import FileLock
+
+# Shared on-disk stock footage cache. Clips are stored under a key derived
+# from the Pexels video id and file variant, so every job reading the same
+# clip uses the same file in place.
+CLIP_CACHE = os.getenv("CLIP_CACHE", "true").lower() in ("1", "true", "yes")
+CLIP_CACHE_DIR = os.getenv("CLIP_CACHE_DIR", ".cache/clips")
+CLIP_CACHE_MAX_BYTES = int(os.getenv("CLIP_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+# Files used more recently than this are never evicted, so a clip another
+# job has just looked up cannot disappear before it is opened.
+CLIP_CACHE_MIN_AGE_SECONDS = float(os.getenv("CLIP_CACHE_MIN_AGE_SECONDS", 600))
+
+# hits/misses/bytes_fetched count downloaded clips; files derived from them
+# (proxies, rendered parts) are counted per kind
+_stats = {"hits": 0, "misses": 0, "bytes_fetched": 0, "evictions": 0, "bytes_evicted": 0}
+_derived_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(kind=None, **values):
+    with _stats_lock:
+        if kind is None:
+            counters = _stats
+        else:
+            counters = _derived_stats.setdefault(kind, {"hits": 0, "misses": 0,
+                                                        "bytes_created": 0})
+        for key, value in values.items():
+            counters[key] += value
+
+
+def clip_key(url, variant=None):
+    """
+    Stable cache key for a clip URL: "pexels-<video id>-<file variant>" for
+    Pexels links, otherwise a hash of the URL.
+    """
+    match = re.search(r"/video-files/(\d+)/([^/?#]+?)(?:\.\w+)?(?:[?#]|$)", url)
+    if match:
+        key = f"pexels-{match.group(1)}-{variant or match.group(2)}"
+    else:
+        match = re.search(r"/external/(\d+)\.(\w+)\.mp4", url)
+        if match:
+            profile = re.search(r"profile_id=(\d+)", url)
+            default_variant = match.group(2) + (f"_{profile.group(1)}" if profile else "")
+            key = f"pexels-{match.group(1)}-{variant or default_variant}"
+        else:
+            key = "url-" + hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+            if variant:
+                key += f"-{variant}"
+    return re.sub(r"[^\w.-]", "_", key)
+
+
+def clip_path(key, extension=".mp4"):
+    return os.path.join(CLIP_CACHE_DIR, key[-2:], key + extension)
+
+
+def get_or_fetch(url, fetch, variant=None, extension=".mp4"):
+    """
+    Return the cached file for url, calling fetch(url, path) to populate it
+    on a miss. Concurrent callers (threads or processes) for the same clip
+    wait on a lock file, so each clip is fetched once.
+    """
+    return get_or_create(clip_key(url, variant), lambda path: fetch(url, path), extension)
+
+
+def get_or_create(key, create, extension=".mp4", kind=None):
+    """
+    Return the cached file for key, calling create(path) to populate it on a
+    miss. create() must write to a temporary file and rename it into place.
+    kind names what derived files (e.g. "proxies") are counted as in the
+    stats; None counts them as downloaded clips.
+    """
+    path = clip_path(key, extension)
+    if os.path.exists(path):
+        _touch(path)
+        _count(kind, hits=1)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with FileLock(path + ".lock"):
+        if os.path.exists(path):
+            _touch(path)
+            _count(kind, hits=1)
+            return path
+        create(path)
+        size = os.path.getsize(path)
+        if kind is None:
+            _count(misses=1, bytes_fetched=size)
+        else:
+            _count(kind, misses=1, bytes_created=size)
+
+    evict()
+    return path
+
+
+def touch(paths):
+    """
+    Mark cached files as just used, so evict() keeps them for another
+    CLIP_CACHE_MIN_AGE_SECONDS. Files outside the cache are left alone.
+    """
+    cache_dir = os.path.abspath(CLIP_CACHE_DIR) + os.sep
+    for path in paths:
+        if os.path.abspath(path).startswith(cache_dir):
+            _touch(path)
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _entries():
+    entries = []
+    for root, _, files in os.walk(CLIP_CACHE_DIR):
+        for name in files:
+            if name.endswith((".lock", ".part", ".url", ".tmp")):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict(max_bytes=None):
+    """
+    Delete least recently used clips until the cache fits its size budget
+    """
+    max_bytes = CLIP_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CLIP_CACHE_DIR):
+        return
+    with FileLock(os.path.join(CLIP_CACHE_DIR, ".evict.lock")):
+        entries = sorted(_entries())
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - CLIP_CACHE_MIN_AGE_SECONDS
+        for mtime, size, path in entries:
+            if total <= max_bytes or mtime > cutoff:
+                break
+            with FileLock(path + ".lock"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            total -= size
+            _count(evictions=1, bytes_evicted=size)
+
+
+def get_stats():
+    """
+    Hit/miss counters (downloaded clips, then each derived kind) plus the
+    current cache size
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        derived = {kind: dict(counters) for kind, counters in _derived_stats.items()}
+    entries = _entries() if os.path.isdir(CLIP_CACHE_DIR) else []
+    stats["files"] = len(entries)
+    stats["bytes"] = sum(size for _, size, _ in entries)
+    stats["max_bytes"] = CLIP_CACHE_MAX_BYTES
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    for kind, counters in derived.items():
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        stats[kind] = counters
+    return stats
@@ -0,0 +1,73 @@
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+from moviepy.config import get_setting
+from utility.video import clip_cache
+
+# Downloaded clips are transcoded once into constant-frame-rate proxies at
+# the output size, so the compositor never resizes frames.
+CLIP_PROXIES = os.getenv("CLIP_PROXIES", "true").lower() in ("1", "true", "yes")
+PROXY_PRESET = os.getenv("PROXY_PRESET", "veryfast")
+PROXY_CRF = int(os.getenv("PROXY_CRF", 18))
+
+
+def source_key(source_path):
+    """
+    Cache key of the source: clips from the clip cache already carry a
+    content key in their file name; other files are keyed by path, size and
+    modification time.
+    """
+    source_path = os.path.abspath(source_path)
+    if source_path.startswith(os.path.abspath(clip_cache.CLIP_CACHE_DIR) + os.sep):
+        return os.path.splitext(os.path.basename(source_path))[0]
+    stat = os.stat(source_path)
+    fingerprint = f"{source_path}|{stat.st_size}|{stat.st_mtime_ns}"
+    return "file-" + hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()[:32]
+
+
+def proxy_filter(width, height, fps):
+    """
+    Scale to cover width x height without distortion, centre-crop the
+    overflow and resample to a constant frame rate
+    """
+    return (f"scale={width}:{height}:force_original_aspect_ratio=increase:flags=lanczos,"
+            f"crop={width}:{height},setsar=1,fps={fps}")
+
+
+def transcode_proxy(source_path, output_path, width, height, fps):
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        subprocess.run([
+            get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+            "-i", source_path,
+            "-an",
+            "-vf", proxy_filter(width, height, fps),
+            "-c:v", "libx264", "-preset", PROXY_PRESET, "-crf", str(PROXY_CRF),
+            "-pix_fmt", "yuv420p",
+            "-g", str(fps),
+            "-movflags", "+faststart",
+            "-f", "mp4", tmp_path
+        ], check=True)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def make_proxy(source_path, width, height, fps, work_dir=None):
+    """
+    Return a proxy of source_path at width x height and fps, transcoding it
+    on first use. The proxy is keyed by source and profile and kept in the
+    clip cache, or in work_dir (the job's own) when the cache is disabled.
+    """
+    key = f"proxy-{source_key(source_path)}-{width}x{height}_{fps}fps"
+    if not clip_cache.CLIP_CACHE:
+        path = os.path.join(work_dir or tempfile.gettempdir(), key + ".mp4")
+        if not os.path.exists(path):
+            transcode_proxy(source_path, path, width, height, fps)
+        return path
+    return clip_cache.get_or_create(
+        key, lambda path: transcode_proxy(source_path, path, width, height, fps),
+        kind="proxies")
@@ -0,0 +1,271 @@
+import hashlib
+import math
+import os
+import re
+import struct
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from moviepy.config import get_setting
+from utility.http_client import get_session, DEFAULT_TIMEOUT
+from utility.video import clip_cache
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("DOWNLOAD_CHUNK_BYTES", 1024 * 1024))
+DOWNLOAD_ATTEMPTS = int(os.getenv("DOWNLOAD_ATTEMPTS", 4))
+
+# Duration-limited downloads: when a job needs only the start of a clip,
+# fetch just that part. Skipped when the clip is not much longer than needed.
+PARTIAL_DOWNLOADS = os.getenv("PARTIAL_DOWNLOADS", "true").lower() in ("1", "true", "yes")
+PARTIAL_MAX_FRACTION = float(os.getenv("PARTIAL_MAX_FRACTION", 0.6))
+# Needed durations are rounded up to this step so jobs share partial files
+PARTIAL_ROUND_SECONDS = float(os.getenv("PARTIAL_ROUND_SECONDS", 5))
+# Extra bytes fetched beyond the proportional estimate (bitrate varies)
+PARTIAL_BYTE_MARGIN = float(os.getenv("PARTIAL_BYTE_MARGIN", 0.35))
+PROBE_BYTES = 64 * 1024
+
+DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "video/webm,video/ogg,video/*;q=0.9,application/ogg;q=0.7,audio/*;q=0.6,*/*;q=0.5",
+}
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _total_size(response, offset):
+    content_range = response.headers.get("Content-Range", "")
+    match = re.search(r"/(\d+)$", content_range)
+    if match:
+        return int(match.group(1))
+    length = response.headers.get("Content-Length")
+    return offset + int(length) if length is not None else None
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def download(url, output_path, expected_size=None, sha256=None):
+    """
+    Download url to output_path through the shared session.
+
+    Data is streamed into output_path + ".part" in large buffered writes. A
+    failed or stalled transfer (connect/read timeout) is resumed from the
+    bytes already on disk with a Range request. The finished file is checked
+    against the server-reported size, expected_size and sha256 (when given)
+    before it is atomically renamed into place.
+    """
+    part_path = output_path + ".part"
+    marker_path = part_path + ".url"
+    # Only resume a partial file that was started for the same URL
+    if os.path.exists(part_path):
+        try:
+            with open(marker_path, "r") as f:
+                resumable = f.read() == url
+        except OSError:
+            resumable = False
+        if not resumable:
+            os.remove(part_path)
+    with open(marker_path, "w") as f:
+        f.write(url)
+
+    last_error = None
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = dict(DOWNLOAD_HEADERS)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+
+            with get_session().get(url, headers=headers, stream=True,
+                                   timeout=DEFAULT_TIMEOUT) as response:
+                if response.status_code == 416 and offset:
+                    # Nothing left to fetch; the size check below decides
+                    total = expected_size or offset
+                else:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # Range ignored by the server: start over
+                        offset = 0
+                    total = _total_size(response, offset)
+                    with open(part_path, "ab" if offset else "wb",
+                              buffering=DOWNLOAD_CHUNK_BYTES) as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                            f.write(chunk)
+
+            size = os.path.getsize(part_path)
+            if (total is not None and size != total) or (expected_size and size != expected_size):
+                os.remove(part_path)
+                raise DownloadError(f"Size mismatch for {url}: got {size}, expected {expected_size or total}")
+            if sha256 and _sha256(part_path) != sha256:
+                os.remove(part_path)
+                raise DownloadError(f"Checksum mismatch for {url}")
+
+            os.replace(part_path, output_path)
+            os.remove(marker_path)
+            return output_path
+
+        except (requests.RequestException, DownloadError, OSError) as e:
+            last_error = e
+            print(f"Download attempt {attempt + 1}/{DOWNLOAD_ATTEMPTS} failed for {url}: {str(e)}")
+            time.sleep(min(10, 2 ** attempt))
+
+    raise DownloadError(f"Failed to download {url}: {last_error}")
+
+
+def probe_faststart(url):
+    """
+    Fetch the first bytes of an MP4 and walk its top-level boxes. Returns
+    (is_faststart, moov_end, total_size): faststart files have their moov
+    index before the media data, so any prefix of them is decodable.
+    """
+    headers = dict(DOWNLOAD_HEADERS, Range=f"bytes=0-{PROBE_BYTES - 1}")
+    response = get_session().get(url, headers=headers, timeout=DEFAULT_TIMEOUT)
+    response.raise_for_status()
+    head = response.content[:PROBE_BYTES]
+    total = _total_size(response, 0) if response.status_code == 206 else len(response.content)
+
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box = struct.unpack(">I4s", head[offset:offset + 8])
+        if size == 1 and offset + 16 <= len(head):
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if box == b"moov":
+            return True, offset + size, total
+        if box == b"mdat" or size < 8:
+            break
+        offset += size
+    return False, None, total
+
+
+def _ffmpeg_trim(source, output_path, duration):
+    """
+    Copy the first duration seconds of source (file or URL) without
+    re-encoding. For URLs ffmpeg only requests the byte ranges it reads.
+    """
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error"]
+    if source.startswith(("http://", "https://")):
+        command += ["-user_agent", DOWNLOAD_HEADERS["User-Agent"]]
+    command += ["-t", f"{duration:.3f}", "-i", source,
+                "-map", "0:v:0", "-c", "copy", "-an",
+                "-movflags", "+faststart", "-f", "mp4", tmp_path]
+    try:
+        subprocess.run(command, check=True)
+        if os.path.getsize(tmp_path) == 0:
+            raise DownloadError(f"Empty trimmed output for {source}")
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def download_head(url, output_path, duration, clip_duration):
+    """
+    Download only the first duration seconds of a clip. Faststart MP4s are
+    fetched as a byte range proportional to the needed duration and remuxed;
+    other files are stream-trimmed by ffmpeg straight from the URL.
+    """
+    faststart, moov_end, total = probe_faststart(url)
+    if faststart and total:
+        estimate = total * (duration / clip_duration) * (1 + PARTIAL_BYTE_MARGIN)
+        end = min(total, int(moov_end + estimate)) - 1
+        head_path = output_path + ".head"
+        try:
+            headers = dict(DOWNLOAD_HEADERS, Range=f"bytes=0-{end}")
+            with get_session().get(url, headers=headers, stream=True,
+                                   timeout=DEFAULT_TIMEOUT) as response:
+                response.raise_for_status()
+                with open(head_path, "wb", buffering=DOWNLOAD_CHUNK_BYTES) as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        f.write(chunk)
+            _ffmpeg_trim(head_path, output_path, duration)
+            return output_path
+        except (requests.RequestException, subprocess.CalledProcessError, DownloadError, OSError) as e:
+            print(f"Ranged download failed for {url}, stream-trimming instead: {str(e)}")
+        finally:
+            if os.path.exists(head_path):
+                os.remove(head_path)
+
+    _ffmpeg_trim(url, output_path, duration)
+    return output_path
+
+
+class DownloadManager:
+    """
+    Fetches files concurrently. submit() returns a future immediately, so
+    callers can start working on the first file while the rest are still
+    downloading. Each URL is downloaded at most once per manager.
+    """
+
+    def __init__(self, max_workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers or DOWNLOAD_WORKERS)
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit(self, url, output_path, expected_size=None, sha256=None):
+        with self.lock:
+            if url not in self.futures:
+                self.futures[url] = self.pool.submit(download, url, output_path,
+                                                     expected_size, sha256)
+            return self.futures[url]
+
+    def submit_clip(self, url, fallback_path, postprocess=None, duration=None, clip_duration=None):
+        """
+        Fetch a stock clip through the shared clip cache and resolve to the
+        cached file, which is read in place. Falls back to a plain download
+        to fallback_path when the cache is disabled. postprocess(path), if
+        given, runs in the worker after the download and its return value
+        becomes the result.
+
+        When duration (seconds needed) and clip_duration are known and the
+        clip is much longer than needed, only its first part is fetched.
+        Local files (the "local" video server) are used where they are.
+        """
+        local = not url.startswith(("http://", "https://"))
+        partial = (not local and PARTIAL_DOWNLOADS and duration and clip_duration
+                   and duration < clip_duration * PARTIAL_MAX_FRACTION)
+
+        def fetch():
+            if local:
+                path = url
+            elif partial:
+                seconds = math.ceil(duration / PARTIAL_ROUND_SECONDS) * PARTIAL_ROUND_SECONDS
+                full_key = clip_cache.clip_key(url)
+                if clip_cache.CLIP_CACHE and os.path.exists(clip_cache.clip_path(full_key)):
+                    # The whole clip is cached already
+                    path = clip_cache.get_or_fetch(url, lambda u, p: download(u, p))
+                elif clip_cache.CLIP_CACHE:
+                    path = clip_cache.get_or_create(
+                        f"{full_key}-head{seconds:g}s",
+                        lambda p: download_head(url, p, seconds, clip_duration))
+                else:
+                    path = download_head(url, fallback_path, seconds, clip_duration)
+            elif clip_cache.CLIP_CACHE:
+                path = clip_cache.get_or_fetch(url, lambda u, p: download(u, p))
+            else:
+                path = download(url, fallback_path)
+            return postprocess(path) if postprocess else path
+
+        with self.lock:
+            if url not in self.futures:
+                self.futures[url] = self.pool.submit(fetch)
+            return self.futures[url]
+
+    def shutdown(self, cancel_pending=True):
+        self.pool.shutdown(wait=True, cancel_futures=cancel_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
@@ -0,0 +1,131 @@
+import math
+import re
+import threading
+from collections import Counter
+
+STOPWORDS = set("""
+a about above after again against all almost also am an and any are aren't around as at be
+because been before being below between both but by can can't cannot could couldn't did didn't
+do does doesn't doing don't down during each even ever every few for from further get gets got
+had hadn't has hasn't have haven't having he he'd he'll he's her here here's hers herself him
+himself his how how's i i'd i'll i'm i've if in into is isn't it it's its itself just know let's
+like made make makes many may me might more most much must mustn't my myself never no nor not now
+of off on once one only or other ought our ours ourselves out over own really same say says she
+she'd she'll she's should shouldn't so some such than that that's the their theirs them
+themselves then there there's these they they'd they'll they're they've thing things this those
+through to too under until up upon us very was wasn't way we we'd we'll we're we've well were
+weren't what what's when when's where where's which while who who's whom why why's will with
+without won't would wouldn't yet you you'd you'll you're you've your yours yourself yourselves
+fact facts known called even ever still use used using can could want wanted new first last
+time times year years day days people thing something anything everything nothing
+""".split())
+
+# Concrete, filmable concepts. Words found here make a segment a confident
+# local hit; everything else is ranked by TF-IDF alone.
+VISUAL_LEXICON = set("""
+airplane airport animal ant ape apple astronaut baby balloon banana beach bear bee bicycle bird
+boat book bread bridge building bus butterfly cake camel camera candle car castle cat cave
+cheetah chef child children church city cliff clock cloud clouds coffee computer cow crowd
+crocodile desert dinosaur doctor dog dolphin door dragon eagle earth elephant engine eye eyes
+factory family farm field fire fireworks fish flag flower flowers food football forest fountain
+fox frog fruit galaxy garden giraffe glacier glass gold gorilla grass guitar hand hands heart
+helicopter highway hill honey horse hospital house ice island jellyfish jungle key kitchen lake
+laptop leaf leaves library light lightning lion map market meadow money monkey moon mountain
+mountains museum mushroom music night ocean octopus office owl painting palace panda paper park
+parrot penguin phone piano planet plant police pyramid rain rainbow river road robot rock rocket
+rose runner sand satellite school sea shark sheep ship sky skyscraper smoke snake snow soldier
+space spider sport stadium star stars statue storm street student sun sunrise sunset swimmer
+table tea temple tiger traffic train tree trees turtle universe valley village volcano wall
+war water waterfall wave waves whale wheat wind window wolf woman man women men wood world zebra
+""".split())
+
+# Local extraction modes:
+#   "llm"    - LLM only; local extraction is used when the LLM fails
+#   "local"  - no LLM calls at all
+#   "hybrid" - local first, LLM only for segments without a lexicon hit
+KEYWORD_MODES = ("llm", "local", "hybrid")
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def record_stats(stats=None, **counts):
+    """
+    Add counts to the global keyword stats and to an optional per-job dict
+    """
+    with _stats_lock:
+        _stats.update(counts)
+    if stats is not None:
+        for key, value in counts.items():
+            stats[key] = stats.get(key, 0) + value
+
+
+def get_stats():
+    """
+    Global keyword extraction counters plus the local hit rate
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    attempts = stats.get("local_hits", 0) + stats.get("local_misses", 0)
+    stats["local_hit_rate"] = stats.get("local_hits", 0) / attempts if attempts else 0.0
+    return stats
+
+
+def tokenize(text):
+    return re.findall(r"[a-z][a-z'-]*[a-z]|[a-z]", text.lower())
+
+
+def candidate_phrases(tokens, max_words=2):
+    """
+    All n-grams of up to max_words words inside runs of non-stopwords
+    """
+    phrases = set()
+    run = []
+    for token in tokens + [None]:
+        if token is None or token in STOPWORDS or len(token) < 3:
+            for size in range(1, max_words + 1):
+                for i in range(len(run) - size + 1):
+                    phrases.add(tuple(run[i:i + size]))
+            run = []
+        else:
+            run.append(token)
+    return phrases
+
+
+def document_frequencies(texts):
+    frequencies = Counter()
+    for text in texts:
+        frequencies.update(set(tokenize(text)))
+    return frequencies
+
+
+def extract_keywords(text, doc_freq=None, n_docs=1, max_terms=3):
+    """
+    Return (search_terms, is_confident) for a segment of text. Phrases are
+    ranked by TF-IDF against the other segments of the job, with a bonus for
+    concrete visual concepts from VISUAL_LEXICON.
+    """
+    doc_freq = doc_freq or {}
+    tokens = tokenize(text)
+    term_freq = Counter(tokens)
+
+    def weight(token):
+        idf = math.log((1 + n_docs) / (1 + doc_freq.get(token, 0))) + 1
+        bonus = 2.0 if token in VISUAL_LEXICON else 1.0
+        return term_freq[token] * idf * bonus
+
+    # Two-word phrases only outrank their best word when both words carry weight
+    scored = {phrase: sum(weight(token) for token in phrase) / len(phrase) ** 0.75
+              for phrase in candidate_phrases(tokens)}
+
+    terms = []
+    used = set()
+    for phrase in sorted(scored, key=lambda p: (-scored[p], p)):
+        if used.isdisjoint(phrase):
+            terms.append(" ".join(phrase))
+            used.update(phrase)
+        if len(terms) == max_terms:
+            break
+
+    is_confident = any(token in VISUAL_LEXICON for term in terms for token in term.split())
+    return (terms or None), is_confident
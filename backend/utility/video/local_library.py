@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import numpy as np
+
+# Local stock footage library used by the "local" video server. The index is
+# built offline:
+#   python -m utility.video.local_library build /path/to/library [--embeddings]
+# Each video is probed for duration, resolution and fps and tagged from its
+# folder names, file name and an optional sidecar (<name>.json with
+# "title"/"tags", or <name>.txt). Lookups use SQLite FTS5, falling back to
+# small hashed text embeddings when the full-text search finds nothing.
+LOCAL_LIBRARY_INDEX = os.getenv("LOCAL_LIBRARY_INDEX", "local_library.sqlite3")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".mkv", ".webm")
+EMBEDDING_DIM = 256
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def connect(index_path=None):
+    conn = sqlite3.connect(index_path or LOCAL_LIBRARY_INDEX, timeout=30)
+    conn.execute("""CREATE TABLE IF NOT EXISTS clips (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        title TEXT,
+        tags TEXT,
+        duration REAL,
+        width INTEGER,
+        height INTEGER,
+        fps REAL,
+        size INTEGER,
+        mtime REAL,
+        embedding BLOB)""")
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS clips_fts USING fts5(
+        title, tags, content='clips', content_rowid='id')""")
+    return conn
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def embed(text):
+    """
+    Small hashed bag-of-words and character-trigram embedding, L2-normalized
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for token in tokenize(text):
+        features = [token] + [f"#{token[i:i + 3]}" for i in range(max(1, len(token) - 2))]
+        for feature in features:
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % EMBEDDING_DIM
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def read_sidecar(video_path):
+    root, _ = os.path.splitext(video_path)
+    if os.path.exists(root + ".json"):
+        with open(root + ".json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+        tags = data.get("tags", [])
+        return data.get("title"), " ".join(tags) if isinstance(tags, list) else str(tags)
+    if os.path.exists(root + ".txt"):
+        with open(root + ".txt", "r", encoding="utf-8") as f:
+            return None, f.read()
+    return None, ""
+
+
+def probe(video_path):
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    infos = ffmpeg_parse_infos(video_path)
+    width, height = infos.get("video_size") or (None, None)
+    return infos.get("duration"), width, height, infos.get("video_fps")
+
+
+def build_index(library_root, index_path=None, embeddings=False):
+    """
+    Add new or changed videos under library_root to the index and drop
+    entries whose files no longer exist
+    """
+    conn = connect(index_path)
+    known = {path: mtime for path, mtime in conn.execute("SELECT path, mtime FROM clips")}
+    seen = set()
+    added = 0
+    for root, _, files in os.walk(library_root):
+        for name in sorted(files):
+            if not name.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            path = os.path.abspath(os.path.join(root, name))
+            seen.add(path)
+            stat = os.stat(path)
+            if known.get(path) == stat.st_mtime:
+                continue
+            try:
+                duration, width, height, fps = probe(path)
+            except Exception as e:
+                print(f"Skipping {path}: {str(e)}")
+                continue
+
+            sidecar_title, sidecar_tags = read_sidecar(path)
+            title = sidecar_title or re.sub(r"[_\-.]+", " ", os.path.splitext(name)[0]).strip()
+            folders = os.path.relpath(root, library_root).replace(os.sep, " ")
+            tags = " ".join(part for part in (folders if folders != "." else "", sidecar_tags) if part)
+            vector = embed(f"{title} {tags}").tobytes() if embeddings else None
+
+            with conn:
+                conn.execute("DELETE FROM clips WHERE path = ?", (path,))
+                cursor = conn.execute(
+                    "INSERT INTO clips (path, title, tags, duration, width, height, fps, size, mtime, embedding) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, title, tags, duration, width, height, fps, stat.st_size, stat.st_mtime, vector))
+            added += 1
+            print(f"Indexed {path} ({cursor.lastrowid})")
+
+    removed = [path for path in known if path not in seen]
+    with conn:
+        conn.executemany("DELETE FROM clips WHERE path = ?", [(path,) for path in removed])
+        conn.execute("INSERT INTO clips_fts(clips_fts) VALUES ('rebuild')")
+    conn.close()
+    print(f"Index updated: {added} added/updated, {len(removed)} removed")
+
+
+def _row_to_clip(row):
+    clip_id, path, title, tags, duration, width, height, fps = row
+    return {
+        'url': path,
+        'video_id': clip_id,
+        'title': title,
+        'tags': tags,
+        'duration': duration,
+        'width': width,
+        'height': height,
+        'fps': fps
+    }
+
+
+def _load_embeddings(conn):
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            rows = conn.execute("SELECT id, embedding FROM clips WHERE embedding IS NOT NULL").fetchall()
+            ids = np.array([row[0] for row in rows])
+            matrix = (np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                      if rows else np.zeros((0, EMBEDDING_DIM), dtype=np.float32))
+            _embeddings = (ids, matrix)
+        return _embeddings
+
+
+def search_local_clip(query, min_duration=None, exclude_ids=(), limit=20):
+    """
+    Return the best matching clip for query. Portrait clips and clips at
+    least min_duration long are preferred among the full-text matches.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    columns = "clips.id, path, title, tags, duration, width, height, fps"
+    conn = connect()
+    try:
+        match = " OR ".join(f'"{token}"' for token in tokens)
+        rows = conn.execute(
+            f"SELECT {columns} FROM clips_fts JOIN clips ON clips.id = clips_fts.rowid "
+            "WHERE clips_fts MATCH ? ORDER BY bm25(clips_fts) LIMIT ?",
+            (match, limit)).fetchall()
+
+        if not rows:
+            ids, matrix = _load_embeddings(conn)
+            if len(ids):
+                scores = matrix @ embed(query)
+                best = [int(ids[i]) for i in np.argsort(-scores)[:limit] if scores[i] > 0]
+                if best:
+                    placeholders = ",".join("?" * len(best))
+                    by_id = {row[0]: row for row in conn.execute(
+                        f"SELECT {columns} FROM clips WHERE id IN ({placeholders})", best)}
+                    rows = [by_id[i] for i in best if i in by_id]
+    finally:
+        conn.close()
+
+    clips = [_row_to_clip(row) for row in rows if row[0] not in exclude_ids]
+    if not clips:
+        return None
+
+    def preference(indexed_clip):
+        rank, clip = indexed_clip
+        portrait = (clip['height'] or 0) >= (clip['width'] or 0)
+        long_enough = min_duration is None or (clip['duration'] or 0) >= min_duration
+        return (not portrait, not long_enough, rank)
+
+    return min(enumerate(clips), key=preference)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local stock footage index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Index (or re-index) a library directory")
+    build.add_argument("library_root")
+    build.add_argument("--index", default=LOCAL_LIBRARY_INDEX)
+    build.add_argument("--embeddings", action="store_true",
+                       help="Store hashed text embeddings for similarity search")
+    search = subparsers.add_parser("search", help="Query the index")
+    search.add_argument("query")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.library_root, args.index, args.embeddings)
+    else:
+        print(json.dumps(search_local_clip(args.query), indent=2))
+
+
+if __name__ == "__main__":
+    main()
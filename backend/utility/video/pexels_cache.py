@@ -0,0 +1,191 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Persistent cache of Pexels search responses. Fresh entries are served
+# without a request; entries past their TTL but inside the stale window are
+# served immediately and refreshed in the background.
+PEXELS_CACHE_PATH = os.getenv("PEXELS_CACHE_PATH", ".cache/pexels.sqlite3")
+PEXELS_CACHE_TTL_SECONDS = float(os.getenv("PEXELS_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+PEXELS_CACHE_STALE_SECONDS = float(os.getenv("PEXELS_CACHE_STALE_SECONDS", 30 * 24 * 3600))
+# Requests kept in reserve: below this many remaining requests in the current
+# quota window, only cached results (of any age) are served.
+PEXELS_QUOTA_RESERVE = int(os.getenv("PEXELS_QUOTA_RESERVE", 20))
+
+_schema_ready = False
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+_stats = {"hits": 0, "stale_hits": 0, "misses": 0, "requests": 0,
+          "revalidations": 0, "quota_denied": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+@contextmanager
+def _connect():
+    global _schema_ready
+    directory = os.path.dirname(PEXELS_CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(PEXELS_CACHE_PATH, timeout=30)
+    try:
+        if not _schema_ready:
+            _create_schema(conn)
+            _schema_ready = True
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _create_schema(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS searches (
+        key TEXT PRIMARY KEY,
+        payload TEXT NOT NULL,
+        fetched_at REAL NOT NULL)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS quota (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        quota_limit INTEGER,
+        remaining INTEGER,
+        reset_at REAL,
+        requests INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL)""")
+    conn.commit()
+
+
+def normalize_query(query):
+    """
+    Lowercase, strip punctuation and collapse whitespace so that e.g.
+    "Sunset View!" and "sunset  view" share a cache entry
+    """
+    query = re.sub(r"[^\w\s]", " ", str(query).lower())
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def cache_key(query, orientation, size, per_page):
+    return f"{normalize_query(query)}|{orientation}|{size}|{per_page}"
+
+
+def _read(key):
+    with _connect() as conn:
+        row = conn.execute("SELECT payload, fetched_at FROM searches WHERE key = ?",
+                           (key,)).fetchone()
+    if row is None:
+        return None, None
+    return json.loads(row[0]), row[1]
+
+
+def _write(key, payload):
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO searches (key, payload, fetched_at) VALUES (?, ?, ?)",
+                     (key, json.dumps(payload), time.time()))
+
+
+def record_quota(headers):
+    """
+    Store the rate-limit headers of a Pexels response and count the request
+    """
+    def header(name):
+        try:
+            return int(headers.get(name))
+        except (TypeError, ValueError):
+            return None
+
+    _count("requests")
+    with _connect() as conn:
+        conn.execute("INSERT OR IGNORE INTO quota (id, requests) VALUES (1, 0)")
+        conn.execute("""UPDATE quota SET
+            quota_limit = COALESCE(?, quota_limit),
+            remaining = COALESCE(?, remaining),
+            reset_at = COALESCE(?, reset_at),
+            requests = requests + 1,
+            updated_at = ? WHERE id = 1""",
+                     (header("X-Ratelimit-Limit"), header("X-Ratelimit-Remaining"),
+                      header("X-Ratelimit-Reset"), time.time()))
+
+
+def get_quota():
+    with _connect() as conn:
+        row = conn.execute("SELECT quota_limit, remaining, reset_at, requests, updated_at "
+                           "FROM quota WHERE id = 1").fetchone()
+    if row is None:
+        return {}
+    return dict(zip(("limit", "remaining", "reset_at", "requests", "updated_at"), row))
+
+
+def quota_available():
+    quota = get_quota()
+    if quota.get("remaining") is None or quota.get("reset_at") is None:
+        return True
+    return quota["remaining"] > PEXELS_QUOTA_RESERVE or time.time() >= quota["reset_at"]
+
+
+def _revalidate(key, fetch):
+    try:
+        payload = fetch()
+        if payload is not None:
+            _write(key, payload)
+    except Exception as e:
+        _count("errors")
+        print(f"Error revalidating Pexels cache entry {key}: {str(e)}")
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+
+def cached_search(query, orientation, size, per_page, fetch):
+    """
+    Return the search response for the normalized query, calling fetch()
+    (which performs the request and returns the JSON payload or None) only
+    when no usable cached entry exists.
+    """
+    key = cache_key(query, orientation, size, per_page)
+    payload, fetched_at = _read(key)
+    age = time.time() - fetched_at if fetched_at is not None else None
+
+    if payload is not None and age < PEXELS_CACHE_TTL_SECONDS:
+        _count("hits")
+        return payload
+
+    has_quota = quota_available()
+    if payload is not None and (age < PEXELS_CACHE_TTL_SECONDS + PEXELS_CACHE_STALE_SECONDS
+                                or not has_quota):
+        _count("stale_hits")
+        if has_quota:
+            with _revalidating_lock:
+                start = key not in _revalidating
+                _revalidating.add(key)
+            if start:
+                _count("revalidations")
+                threading.Thread(target=_revalidate, args=(key, fetch), daemon=True).start()
+        return payload
+
+    if not has_quota:
+        _count("quota_denied")
+        print(f"Pexels quota reserve reached, skipping search for: {query}")
+        return None
+
+    _count("misses")
+    payload = fetch()
+    if payload is not None:
+        _write(key, payload)
+    return payload
+
+
+def get_stats():
+    """
+    Cache hit/miss counters and the last known Pexels quota
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["quota"] = get_quota()
+    return stats
@@ -1,24 +1,39 @@
-from openai import OpenAI
 import os
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from utility.utils import log_response, LOG_TYPE_GPT
+from utility.llm.gateway import chat, PROVIDER_GROQ, PROVIDER_OPENAI
+from utility.video.keyword_extractor import (KEYWORD_MODES, document_frequencies,
+                                             extract_keywords, record_stats)
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
 if GROQ_API_KEY and len(GROQ_API_KEY) > 30:
-    from groq import Groq
     model = "llama3-70b-8192"
-    client = Groq(
-        api_key=GROQ_API_KEY,
-    )
+    provider = PROVIDER_GROQ
 else:
     model = "gpt-4"
-    OPENAI_API_KEY = os.environ.get('OPENAI_KEY')
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    provider = PROVIDER_OPENAI
 
 log_directory = ".logs/gpt_logs"
 
+# Search term generation for timed segments:
+#   "batch"      - segments are sent in structured prompts of up to
+#                  SEARCH_TERMS_BATCH_SIZE segments each
+#   "concurrent" - one request per segment through a bounded thread pool
+SEARCH_TERMS_MODE = os.getenv("SEARCH_TERMS_MODE", "batch")
+SEARCH_TERMS_BATCH_SIZE = int(os.getenv("SEARCH_TERMS_BATCH_SIZE", 40))
+SEARCH_TERMS_CONCURRENCY = int(os.getenv("SEARCH_TERMS_CONCURRENCY", 8))
+SEARCH_TERMS_MODEL = "gpt-3.5-turbo"
+
+# Local keyword extraction: "llm", "local" or "hybrid" (see keyword_extractor)
+KEYWORD_MODE = os.getenv("KEYWORD_MODE", "llm")
+
+batch_prompt = """Generate 3 specific, visual search terms for video footage for each numbered text segment below.
+Each search term must depict something visually concrete (e.g. 'crying child', 'rainy street'), be in English, and be short.
+Respond only with a JSON object of the form {"segments": [["term1", "term2", "term3"], ...]} containing exactly one list per segment, in the same order as the segments."""
+
 prompt = """# Instructions
 
 Given the following video script and timed captions, extract three visually concrete and specific keywords for each time segment that can be used to search for background videos. The keywords should be short and capture the main essence of the sentence. They can be synonyms or related terms. If a caption is vague or general, consider the next timed caption for more context. If a keyword is a single word, try to return a two-word keyword that is visually concrete. If a time frame contains two or more important pieces of information, divide it into shorter time frames with one keyword each. Ensure that the time periods are strictly consecutive and cover the entire length of the video. Each keyword should cover between 2-4 seconds. The output should be in JSON format, like this: [[[t1, t2], ["keyword1", "keyword2", "keyword3"]], [[t2, t3], ["keyword4", "keyword5", "keyword6"]], ...]. Please handle all edge cases, such as overlapping time segments, vague or general captions, and single-word keywords.
@@ -52,9 +67,10 @@ def fix_json(json_str):
     return json_str
 
 
-def getVideoSearchQueriesTimed(content, timed_captions):
+def getVideoSearchQueriesTimed(content, timed_captions, keyword_mode=None, stats=None):
     """
-    Generate video search queries for each segment of the content
+    Generate video search queries for each segment of the content.
+    If a stats dict is given it is filled with keyword extraction counters.
     """
     try:
         # Extract text segments
@@ -76,6 +92,8 @@ def getVideoSearchQueriesTimed(content, timed_captions):
         if not captions:
             return None
 
+        segment_texts = []
+
         current_segment = []
         current_start = captions[0][0]
         current_end = current_start + segment_duration
@@ -87,11 +105,10 @@ def getVideoSearchQueriesTimed(content, timed_captions):
 
             # If this caption starts after the current segment ends, create a new segment
             if start_time >= current_end:
-                # Create search terms for the current segment
+                # Queue the current segment for search term generation
                 if current_segment:
-                    segment_text = " ".join([c[2] for c in current_segment])
-                    search_terms = generate_search_terms(segment_text)
-                    segments.append([current_start, current_end, search_terms])
+                    segment_texts.append(" ".join([c[2] for c in current_segment]))
+                    segments.append([current_start, current_end, None])
 
                 # Start a new segment
                 current_segment = []
@@ -103,12 +120,16 @@ def getVideoSearchQueriesTimed(content, timed_captions):
 
             # Handle the last caption
             if i == len(captions) - 1:
-                # Create search terms for the final segment
+                # Queue the final segment
                 if current_segment:
-                    segment_text = " ".join([c[2] for c in current_segment])
-                    search_terms = generate_search_terms(segment_text)
+                    segment_texts.append(" ".join([c[2] for c in current_segment]))
                     # Use the actual end time of the last caption
-                    segments.append([current_start, end_time, search_terms])
+                    segments.append([current_start, end_time, None])
+
+        # Generate search terms for all segments at once, in segment order
+        for segment, search_terms in zip(segments, generate_search_terms_for_segments(
+                segment_texts, keyword_mode=keyword_mode, stats=stats)):
+            segment[2] = search_terms
 
         # Ensure we have coverage for the entire duration
         if segments:
@@ -128,17 +149,108 @@ def getVideoSearchQueriesTimed(content, timed_captions):
         return None
 
 
+def generate_search_terms_for_segments(texts, mode=None, keyword_mode=None, stats=None):
+    """
+    Generate search terms for every segment text. The returned list has one
+    entry per text, in the same order.
+    """
+    keyword_mode = keyword_mode or KEYWORD_MODE
+    if keyword_mode not in KEYWORD_MODES:
+        raise ValueError(f"Unknown keyword mode: {keyword_mode}")
+
+    doc_freq = document_frequencies(texts)
+    local_results = [extract_keywords(text, doc_freq, len(texts)) for text in texts]
+    results = [None] * len(texts)
+    llm_indexes = []
+    for i, (terms, is_confident) in enumerate(local_results):
+        if keyword_mode != "llm":
+            # Only confident, non-empty extractions count as hits, also in
+            # "local" mode where every result is used as is
+            if terms and is_confident:
+                record_stats(stats, local_hits=1)
+            elif terms:
+                record_stats(stats, local_misses=1)
+            else:
+                record_stats(stats, local_misses=1, local_empty=1)
+        if keyword_mode == "local" or (keyword_mode == "hybrid" and is_confident):
+            results[i] = terms
+        else:
+            llm_indexes.append(i)
+
+    if llm_indexes:
+        record_stats(stats, llm_segments=len(llm_indexes))
+        llm_terms = generate_llm_search_terms([texts[i] for i in llm_indexes], mode)
+        for i, terms in zip(llm_indexes, llm_terms):
+            if not terms:
+                # The LLM failed for this segment: use the local extraction
+                record_stats(stats, llm_failures=1, local_fallbacks=1)
+                terms = local_results[i][0]
+            results[i] = terms
+
+    return results
+
+
+def generate_llm_search_terms(texts, mode=None):
+    """
+    Generate search terms for every segment text with the LLM. The returned
+    list has one entry per text (None on failure), in the same order.
+    """
+    mode = mode or SEARCH_TERMS_MODE
+    if not texts:
+        return []
+
+    with ThreadPoolExecutor(max_workers=SEARCH_TERMS_CONCURRENCY) as pool:
+        if mode == "concurrent":
+            return list(pool.map(generate_search_terms, texts))
+
+        batches = [texts[i:i + SEARCH_TERMS_BATCH_SIZE]
+                   for i in range(0, len(texts), SEARCH_TERMS_BATCH_SIZE)]
+        results = []
+        for batch, batch_terms in zip(batches, pool.map(generate_search_terms_batch, batches)):
+            if batch_terms is None:
+                # Malformed batch response: retry its segments one by one
+                batch_terms = list(pool.map(generate_search_terms, batch))
+            results.extend(batch_terms)
+        return results
+
+
+def generate_search_terms_batch(texts):
+    """
+    Generate search terms for several segments in a single request.
+    Returns None when the response does not contain one list per segment.
+    """
+    try:
+        segments_text = "\n".join(f"{i + 1}. {text}" for i, text in enumerate(texts))
+        content = chat(
+            model=SEARCH_TERMS_MODEL,
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": batch_prompt},
+                {"role": "user", "content": segments_text}
+            ]
+        ).strip()
+        log_response(LOG_TYPE_GPT, segments_text, content)
+        search_terms = json.loads(content).get("segments")
+        if not isinstance(search_terms, list) or len(search_terms) != len(texts):
+            print(f"Batched search terms returned {len(search_terms or [])} entries for {len(texts)} segments")
+            return None
+        return [terms if isinstance(terms, list) and terms else None for terms in search_terms]
+
+    except Exception as e:
+        print(f"Error in generate_search_terms_batch: {str(e)}")
+        return None
+
+
 def generate_search_terms(text):
     """
     Generate search terms for a segment of text
     """
     try:
         # Use OpenAI to generate relevant search terms
-        client = OpenAI()
         prompt = f"Generate 3 specific, visual search terms for video footage that would match this text: '{text}'. Format as a JSON array of strings. Example: ['peaceful nature', 'flowing water', 'sunset view']"
 
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = chat(
+            model=SEARCH_TERMS_MODEL,
             messages=[
                 {"role": "system", "content": "You are a helpful assistant that generates specific video search terms."},
                 {"role": "user", "content": prompt}
@@ -146,7 +258,7 @@ def generate_search_terms(text):
         )
 
         # Extract and parse the JSON array from the response
-        search_terms_str = response.choices[0].message.content.strip()
+        search_terms_str = response.strip()
         if search_terms_str.startswith("[") and search_terms_str.endswith("]"):
             search_terms = json.loads(search_terms_str)
             return search_terms
@@ -166,16 +278,19 @@ Timed Captions:{}
 """.format(script, "".join(map(str, captions_timed)))
     print("Content", user_content)
 
-    response = client.chat.completions.create(
+    # Sampled at temperature 1, so not cached
+    response = chat(
         model=model,
+        provider=provider,
         temperature=1,
+        cache=False,
         messages=[
             {"role": "system", "content": prompt},
             {"role": "user", "content": user_content}
         ]
     )
 
-    text = response.choices[0].message.content.strip()
+    text = response.strip()
     text = re.sub('\s+', ' ', text)
     print("Generated search terms:", text)
     log_response(LOG_TYPE_GPT, script, text)